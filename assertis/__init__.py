@@ -1,18 +1,127 @@
+import asyncio
 import os
 import tempfile
+from contextlib import aclosing
+from pathlib import Path
 
-from assertis.comparison import write_comparison
-from assertis.models import Report, report_to_string
+from assertis.comparison import (
+    add_results,
+    iter_comparison_async,
+    run_memory_comparison,
+    sort_key,
+    write_comparison,
+)
+from assertis.models import DiffOptions, PathFilter, Report, report_to_string
+from assertis.write import write_report
 
 
 class ComparisonException(Exception):
     pass
 
 
-def compare(expected_dir, actual_dir, report_dir=None, sensitivity=0):
+def compare(
+    expected_dir,
+    actual_dir,
+    report_dir=None,
+    sensitivity=0,
+    jobs=1,
+    cache=True,
+    report_format="json",
+    page_size=0,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    profile=False,
+    include=(),
+    exclude=(),
+    shard=None,
+):
     if report_dir is None:
         report_dir = tempfile.mkdtemp(prefix="assertis_")
 
-    report = write_comparison(expected_dir, actual_dir, report_dir, sensitivity)
+    report = write_comparison(
+        expected_dir,
+        actual_dir,
+        report_dir,
+        sensitivity,
+        jobs,
+        cache,
+        report_format,
+        page_size,
+        diff_options,
+        fail_fast,
+        changes_only,
+        profile,
+        PathFilter(include=include, exclude=exclude),
+        shard,
+    )
     if report.has_changes:
-        raise ComparisonException(report_to_string(report, report_dir))
+        raise ComparisonException(report_to_string(report, report_dir, expected_dir))
+
+
+async def compare_async(
+    expected_dir,
+    actual_dir,
+    report_dir=None,
+    sensitivity=0,
+    jobs=1,
+    cache=True,
+    page_size=0,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    include=(),
+    exclude=(),
+):
+    "Like compare(), but yield each file entry as it completes without blocking."
+    if report_dir is None:
+        report_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="assertis_")
+
+    report_dir = Path(report_dir)
+    await asyncio.to_thread(report_dir.mkdir, parents=True, exist_ok=True)
+    report = Report(changes_only=changes_only)
+    comparison = iter_comparison_async(
+        expected_dir,
+        actual_dir,
+        sensitivity,
+        jobs,
+        cache,
+        diff_options,
+        PathFilter(include=include, exclude=exclude),
+    )
+    async with aclosing(comparison):
+        async for result in comparison:
+            # Outputs go to disk as each pair completes
+            await asyncio.to_thread(
+                add_results, report, [result], fail_fast, report_dir
+            )
+            yield result[0]
+            if report.partial:
+                break
+
+    report.files.sort(key=sort_key)
+    await asyncio.to_thread(write_report, report, report_dir, page_size)
+    if report.has_changes:
+        raise ComparisonException(report_to_string(report, report_dir, expected_dir))
+
+
+def compare_in_memory(
+    expected,
+    actual,
+    sensitivity=0,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    include=(),
+    exclude=(),
+) -> Report:
+    "Compare mappings of names to PIL images, bytes or buffers and return the report."
+    return run_memory_comparison(
+        expected,
+        actual,
+        sensitivity,
+        diff_options,
+        fail_fast,
+        changes_only,
+        PathFilter(include=include, exclude=exclude),
+    )
@@ -5,6 +5,7 @@ import click
 
 from assertis.cmd_compare import compare
 from assertis.cmd_fix import fix
+from assertis.cmd_merge import merge
 from assertis.cmd_serve import serve
 from assertis.cmd_verify import verify
 
@@ -19,6 +20,7 @@ assertis.add_command(compare)
 assertis.add_command(serve)
 assertis.add_command(fix)
 assertis.add_command(verify)
+assertis.add_command(merge)
 
 if __name__ == "__main__":
     assertis()
@@ -5,6 +5,20 @@ import click
 
 from assertis.comparison import write_comparison
 from assertis.models import report_to_string
+from assertis.options import with_diff_options, with_filter_options
+
+
+def parse_shard(ctx, param, value):
+    "Parse an INDEX/COUNT shard into a tuple of integers."
+    if value is None:
+        return None
+    try:
+        index, count = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected INDEX/COUNT, like 2/16")
+    if not 1 <= index <= count:
+        raise click.BadParameter("INDEX must be between 1 and COUNT")
+    return index, count
 
 
 @click.command()
@@ -16,7 +30,66 @@ from assertis.models import report_to_string
     default=0,
     help="Sensitivity level for detecting changes (0-100, default is 0).",
 )
-def compare(expected, actual, output, sensitivity):
+@click.option(
+    "--jobs",
+    default=1,
+    help="Number of worker processes used to compare files (default is 1).",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Reuse digests of unchanged files from previous runs (default is on).",
+)
+@click.option(
+    "--format",
+    "report_format",
+    type=click.Choice(["json", "ndjson"]),
+    default="json",
+    help="Report format, json or line-delimited ndjson (default is json).",
+)
+@click.option(
+    "--page-size",
+    default=0,
+    help="Load the HTML report in pages of N files (default is 0, no paging).",
+)
+@with_diff_options
+@click.option(
+    "--fail-fast",
+    is_flag=True,
+    help="Stop at the first difference and only report that file.",
+)
+@click.option(
+    "--changes-only",
+    is_flag=True,
+    help="Don't copy unchanged images into the report directory.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Record per-stage and per-file timings and print the slowest pairs.",
+)
+@with_filter_options
+@click.option(
+    "--shard",
+    callback=parse_shard,
+    help="Only compare shard INDEX of COUNT (1-based), for merging later.",
+)
+def compare(
+    expected,
+    actual,
+    output,
+    sensitivity,
+    jobs,
+    cache,
+    report_format,
+    page_size,
+    diff_options,
+    fail_fast,
+    changes_only,
+    profile,
+    path_filter,
+    shard,
+):
     "Compare images in the expected and actual directories."
     report_dir = Path(output)
     if report_dir.exists():
@@ -28,7 +101,22 @@ def compare(expected, actual, output, sensitivity):
     else:
         report_dir.mkdir(parents=True)
 
-    report = write_comparison(expected, actual, report_dir, sensitivity)
+    report = write_comparison(
+        expected,
+        actual,
+        report_dir,
+        sensitivity,
+        jobs,
+        cache,
+        report_format,
+        page_size,
+        diff_options,
+        fail_fast,
+        changes_only,
+        profile,
+        path_filter,
+        shard,
+    )
     click.echo(report_to_string(report, output, expected))
     if report.has_changes:
         sys.exit(1)
@@ -1,43 +1,294 @@
+import errno
 import json
+import os
 import shutil
 import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import click
 
 from assertis.cmd_verify import verify_report
-from assertis.models import AddedFile, ChangedFile, DeletedFile, Report, UnchangedFile
+from assertis.file_utils import copy_file, link_file
+from assertis.models import (
+    AddedFile,
+    ChangedFile,
+    DeletedFile,
+    iter_report_files,
+    load_report,
+)
 
+# Kept next to the expected directory, so that comparisons don't walk into it
+# while backups can usually still be renamed into place
+JOURNAL_SUFFIX = ".assertis-fix"
 
-def apply_changes(report, report_dir, expected_dir, dry_run):
-    "Apply changes to the expected directory based on the report."
-    for file in report.files:
-        target_path = Path(expected_dir) / file.name
-        target_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if isinstance(file, AddedFile) or isinstance(file, ChangedFile):
-            source_path = Path(report_dir) / file.actual_file
-            if not dry_run:
-                shutil.copy(source_path, target_path)
-            click.echo(
-                f"{'Would copy' if dry_run else 'Copied'} file {source_path} to {target_path}"
-            )
+def journal_dir(expected_dir):
+    expected_dir = Path(expected_dir).resolve()
+    return expected_dir.with_name(f".{expected_dir.name}{JOURNAL_SUFFIX}")
+
+
+class Journal:
+    "Record a fix next to the expected directory so it can be resumed or rolled back."
+
+    def __init__(self, expected_dir):
+        self.dir = journal_dir(expected_dir)
+        self.plan_file = self.dir / "plan.json"
+        self.done_file = self.dir / "done"
+        self.backup_dir = self.dir / "backup"
+        self.lock = threading.Lock()
+        self.done = None
+
+    def exists(self):
+        return self.plan_file.exists()
+
+    def start(self, operations):
+        "Write the plan of operations before any of them runs."
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        temp = self.dir / f".{self.plan_file.name}.tmp"
+        with open(temp, "w") as f:
+            json.dump(operations, f)
+        os.replace(temp, self.plan_file)
+        self.done = open(self.done_file, "a")
+
+    def load(self):
+        "Return the planned operations and the names of those already applied."
+        with open(self.plan_file) as f:
+            operations = json.load(f)
+        done = set()
+        if self.done_file.exists():
+            done = set(self.done_file.read_text().splitlines())
+        self.done = open(self.done_file, "a")
+        return operations, done
+
+    def backup_path(self, name):
+        return self.backup_dir / name
+
+    def mark_done(self, name):
+        with self.lock:
+            self.done.write(name + "\n")
+            self.done.flush()
+
+    def finish(self):
+        "Drop the journal and its backups once every operation has been applied."
+        if self.done:
+            self.done.close()
+        shutil.rmtree(self.dir)
 
+
+def plan_changes(files, report_dir, expected_dir):
+    "Turn report entries into [name, source, existed] operations and count types."
+    report_dir = Path(report_dir).resolve()
+    operations = []
+    counts = defaultdict(int)
+    for file in files:
+        counts[file.type] += 1
+        if isinstance(file, (AddedFile, ChangedFile)):
+            source = str(report_dir / file.actual_file)
         elif isinstance(file, DeletedFile):
-            if not dry_run:
-                target_path.unlink()
-            click.echo(f"{'Would delete' if dry_run else 'Deleted'} file {target_path}")
+            source = None
+        else:
+            continue
+        existed = os.path.lexists(expected_dir / file.name)
+        operations.append([file.name, source, existed])
+    return operations, counts
+
+
+def make_parents(journal, expected_dir, operations):
+    "Create the directories the operations write to, each only once."
+    parents = set()
+    for name, source, existed in operations:
+        if source is not None:
+            parents.add((expected_dir / name).parent)
+        if existed:
+            parents.add(journal.backup_path(name).parent)
+    for parent in sorted(parents):
+        parent.mkdir(parents=True, exist_ok=True)
+
+
+def replace_file(source, target, keep=False):
+    "Move or copy a file so that the target only appears once it is complete."
+    if not keep:
+        try:
+            os.replace(source, target)
+            return
+        except OSError as e:
+            # The journal is on another filesystem when EXPECTED is a mount
+            if e.errno != errno.EXDEV:
+                raise
+    temp = target.with_name(f".{target.name}.tmp")
+    temp.unlink(missing_ok=True)
+    link_file(source, temp)
+    os.replace(temp, target)
+    if not keep:
+        os.unlink(source)
+
+
+def apply_operation(journal, expected_dir, hardlink, operation):
+    "Back up the target of an operation, then replace or delete it."
+    name, source, existed = operation
+    target = expected_dir / name
+    backup = journal.backup_path(name)
+
+    # Steps are idempotent so that a resumed fix can repeat them
+    if existed and not os.path.lexists(backup):
+        replace_file(target, backup, keep=source is not None)
+
+    if source is None:
+        target.unlink(missing_ok=True)
+    else:
+        temp = target.with_name(f".{target.name}.tmp")
+        temp.unlink(missing_ok=True)
+        (link_file if hardlink else copy_file)(source, temp)
+        os.replace(temp, target)
+    journal.mark_done(name)
+
+
+def rollback_operation(journal, expected_dir, operation):
+    "Restore the target of an operation from its backup."
+    name, source, existed = operation
+    target = expected_dir / name
+    backup = journal.backup_path(name)
 
-        elif isinstance(file, UnchangedFile):
-            click.echo(f"File {target_path} is unchanged")
+    target.with_name(f".{target.name}.tmp").unlink(missing_ok=True)
+    if os.path.lexists(backup):
+        replace_file(backup, target)
+    elif not existed:
+        target.unlink(missing_ok=True)
+
+
+def run_operations(function, operations, jobs):
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Consume the results so that the first error is raised
+        for _ in executor.map(function, operations):
+            pass
+
+
+def apply_changes(files, report_dir, expected_dir, dry_run, jobs=8, hardlink=False):
+    "Apply the report's file entries to the expected directory and count them."
+    expected_dir = Path(expected_dir)
+    operations, counts = plan_changes(files, report_dir, expected_dir)
+    if dry_run:
+        return operations, counts
+    if jobs < 1:
+        raise ValueError("jobs must be at least 1")
+
+    journal = Journal(expected_dir)
+    journal.start(operations)
+    try:
+        make_parents(journal, expected_dir, operations)
+    except BaseException:
+        # Nothing has been applied yet, so there is nothing to resume
+        journal.finish()
+        raise
+    run_operations(
+        partial(apply_operation, journal, expected_dir, hardlink), operations, jobs
+    )
+    journal.finish()
+    return operations, counts
+
+
+def resume_changes(expected_dir, jobs=8, hardlink=False):
+    "Apply the operations an interrupted fix had not finished."
+    expected_dir = Path(expected_dir)
+    journal = Journal(expected_dir)
+    operations, done = journal.load()
+    pending = [operation for operation in operations if operation[0] not in done]
+    make_parents(journal, expected_dir, pending)
+    run_operations(
+        partial(apply_operation, journal, expected_dir, hardlink), pending, jobs
+    )
+    journal.finish()
+    return pending
+
+
+def rollback_changes(expected_dir, jobs=8):
+    "Undo every operation of an interrupted fix."
+    expected_dir = Path(expected_dir)
+    journal = Journal(expected_dir)
+    operations, _ = journal.load()
+    run_operations(partial(rollback_operation, journal, expected_dir), operations, jobs)
+    journal.finish()
+    return operations
+
+
+def summarize_changes(counts, dry_run):
+    "Describe the counts of applied changes in one line."
+    copied = counts["added"] + counts["changed"]
+    if dry_run:
+        return (
+            f"Would copy {copied} file(s) and delete {counts['deleted']} file(s); "
+            f"{counts['unchanged']} unchanged."
+        )
+    return (
+        f"Copied {copied} file(s) and deleted {counts['deleted']} file(s); "
+        f"{counts['unchanged']} unchanged."
+    )
+
+
+def echo_operations(operations, dry_run):
+    for name, source, _ in operations:
+        if source is None:
+            click.echo(f"{'Would delete' if dry_run else 'Deleted'} file {name}")
+        else:
+            click.echo(
+                f"{'Would copy' if dry_run else 'Copied'} file {source} to {name}"
+            )
 
 
 @click.command()
 @click.argument("expected")
-@click.argument("report")
+@click.argument("report", required=False)
 @click.option("--dry-run", is_flag=True, help="Run the command in dry run mode.")
-def fix(expected, report, dry_run):
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=8,
+    help="Number of threads used to apply changes (default is 8).",
+)
+@click.option(
+    "--hardlink",
+    is_flag=True,
+    help="Hardlink baselines to the report's images instead of copying them.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Finish an interrupted fix instead of starting a new one.",
+)
+@click.option(
+    "--rollback",
+    is_flag=True,
+    help="Undo an interrupted fix, restoring the expected directory.",
+)
+@click.option("--verbose", is_flag=True, help="List every copied or deleted file.")
+def fix(expected, report, dry_run, jobs, hardlink, resume, rollback, verbose):
     "Apply changes to the expected directory."
+    journal = Journal(expected)
+    if resume or rollback:
+        if not journal.exists():
+            click.echo("No interrupted fix found.")
+            sys.exit(1)
+        if rollback:
+            operations = rollback_changes(expected, jobs)
+            click.echo(f"Rolled back {len(operations)} change(s).")
+        else:
+            operations = resume_changes(expected, jobs, hardlink)
+            click.echo(f"Resumed and applied {len(operations)} remaining change(s).")
+        return
+
+    if journal.exists():
+        click.echo(
+            f"An interrupted fix was found in {journal.dir}. "
+            "Run fix again with --resume or --rollback."
+        )
+        sys.exit(1)
+
+    if report is None:
+        raise click.UsageError("Missing argument 'REPORT'.")
     report_dir = Path(report)
     report_file = report_dir / "report.json"
 
@@ -45,15 +296,36 @@ def fix(expected, report, dry_run):
         click.echo(f"Report file {report_file} does not exist.")
         return
 
-    with open(report_file, "r") as f:
-        report = json.load(f)
-
-    report = Report(**report)
+    report_header = load_report(report_dir)
+    if report_header.partial:
+        click.echo("Report is partial (--fail-fast). Generate a full report first.")
+        sys.exit(1)
 
-    errors = verify_report(report, report_dir, Path(expected))
+    errors = verify_report(
+        iter_report_files(report_dir),
+        report_dir,
+        Path(expected),
+        changes_only=report_header.changes_only,
+    )
     if errors:
         for error in errors:
             click.echo(error)
         sys.exit(1)
 
-    apply_changes(report, report_dir, Path(expected), dry_run)
+    try:
+        operations, counts = apply_changes(
+            iter_report_files(report_dir),
+            report_dir,
+            Path(expected),
+            dry_run,
+            jobs,
+            hardlink,
+        )
+    except OSError as e:
+        click.echo(f"Fix interrupted: {e}")
+        if journal.exists():
+            click.echo("Run fix again with --resume or --rollback.")
+        sys.exit(1)
+    if verbose:
+        echo_operations(operations, dry_run)
+    click.echo(summarize_changes(counts, dry_run))
@@ -0,0 +1,129 @@
+import shutil
+import sys
+from pathlib import Path
+
+import click
+
+from assertis.comparison import sort_key
+from assertis.file_utils import copy_file
+from assertis.models import (
+    NDJSON_FILES,
+    Output,
+    Report,
+    iter_report_files,
+    load_report,
+    report_to_string,
+)
+from assertis.write import (
+    THUMBNAILS_DIR,
+    record_output,
+    thumbnail_name,
+    write_report,
+)
+
+
+def check_shards(shards):
+    "Check that shards come from one partition and warn about missing ones."
+    if not shards:
+        return
+    counts = {count for _, count in shards}
+    if len(counts) > 1:
+        raise ValueError("Reports come from shardings with different counts.")
+    missing = set(range(1, counts.pop() + 1)) - {index for index, _ in shards}
+    if missing:
+        missing_str = ", ".join(map(str, sorted(missing)))
+        click.echo(f"Warning: shards {missing_str} are missing.", err=True)
+
+
+def merge_reports(report_dirs, output_dir, report_format="json", page_size=0):
+    "Combine report directories into one report, copying each shared asset once."
+    output_dir = Path(output_dir)
+    report_dirs = list(map(Path, report_dirs))
+    headers = [load_report(report_dir) for report_dir in report_dirs]
+    # Check the shards before copying anything into the output directory
+    check_shards(
+        [tuple(map(int, header.shard.split("/"))) for header in headers if header.shard]
+    )
+
+    (output_dir / THUMBNAILS_DIR).mkdir(exist_ok=True)
+    report = Report()
+    names = set()
+    copied = set()
+
+    if report_format == "ndjson":
+        report.files_file = NDJSON_FILES
+
+    for report_dir, header in zip(report_dirs, headers):
+        report.partial = report.partial or header.partial
+        report.changes_only = report.changes_only or header.changes_only
+
+        for file in iter_report_files(report_dir):
+            if file.name in names:
+                raise ValueError(f"{file.name} is in more than one report.")
+            names.add(file.name)
+            report.files.append(file)
+
+            for filename in [
+                getattr(file, "actual_file", None),
+                getattr(file, "expected_file", None),
+                getattr(file, "diff_file", None),
+            ]:
+                # Changes-only reports don't hold their unchanged images
+                source = report_dir / filename if filename else None
+                if filename in copied or not source or not source.exists():
+                    continue
+                copied.add(filename)
+                output = Output(filename=filename, content=source)
+                record_output(report, output, output_dir)
+
+                # Reuse the shard's thumbnail instead of rendering it again
+                thumbnail = report_dir / thumbnail_name(filename)
+                target = output_dir / thumbnail_name(filename)
+                if thumbnail.exists() and not target.exists():
+                    copy_file(thumbnail, target)
+
+    report.files.sort(key=sort_key)
+    write_report(report, output_dir, page_size)
+    return report
+
+
+@click.command()
+@click.argument("output")
+@click.argument("reports", nargs=-1, required=True)
+@click.option(
+    "--format",
+    "report_format",
+    type=click.Choice(["json", "ndjson"]),
+    default="json",
+    help="Report format, json or line-delimited ndjson (default is json).",
+)
+@click.option(
+    "--page-size",
+    default=0,
+    help="Load the HTML report in pages of N files (default is 0, no paging).",
+)
+def merge(output, reports, report_format, page_size):
+    "Merge the report directories of sharded comparisons into one report."
+    report_dir = Path(output)
+    if report_dir.exists():
+        if any(report_dir.iterdir()):
+            click.echo(
+                "Output directory already exists and is not empty. Please remove it first."
+            )
+            sys.exit(1)
+    else:
+        report_dir.mkdir(parents=True)
+
+    try:
+        report = merge_reports(reports, report_dir, report_format, page_size)
+    except ValueError as e:
+        # The directory was empty, so don't leave a partial report behind
+        shutil.rmtree(report_dir)
+        click.echo(str(e), err=True)
+        sys.exit(1)
+
+    click.echo(report_to_string(report, output))
+    if report.has_changes:
+        sys.exit(1)
+    else:
+        sys.exit(0)
@@ -10,16 +10,166 @@ import click
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from assertis.comparison import write_comparison
+from assertis.comparison import update_comparison, write_comparison
+from assertis.options import with_diff_options, with_filter_options
+from assertis.write import write_report
 
+# How long to wait for more file events before updating the report
+DEBOUNCE_SECONDS = 0.5
 
-def write_comparison_with_timing(expected, actual, report_dir, sensitivity):
+
+def write_comparison_with_timing(
+    expected,
+    actual,
+    report_dir,
+    sensitivity,
+    jobs=1,
+    cache=True,
+    page_size=0,
+    diff_options=None,
+    path_filter=None,
+):
     click.echo("Writing comparison...")
     start_time = time.time()
-    write_comparison(expected, actual, report_dir, sensitivity)
+    report = write_comparison(
+        expected,
+        actual,
+        report_dir,
+        sensitivity,
+        jobs,
+        cache,
+        page_size=page_size,
+        diff_options=diff_options,
+        path_filter=path_filter,
+    )
     end_time = time.time()
     duration = end_time - start_time
     click.echo(f"Comparison written in {duration:.2f} seconds.")
+    return report
+
+
+class LiveReport:
+    "Keep the last report in memory and patch it as files change."
+
+    def __init__(
+        self,
+        expected,
+        actual,
+        report_dir,
+        sensitivity,
+        jobs,
+        cache,
+        page_size,
+        diff_options,
+        path_filter,
+    ):
+        self.expected = expected
+        self.actual = actual
+        self.report_dir = report_dir
+        self.sensitivity = sensitivity
+        self.jobs = jobs
+        self.cache = cache
+        self.page_size = page_size
+        self.diff_options = diff_options
+        self.path_filter = path_filter
+        self.report = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        "Rebuild the whole report."
+        with self.lock:
+            self.report = write_comparison_with_timing(
+                self.expected,
+                self.actual,
+                self.report_dir,
+                self.sensitivity,
+                self.jobs,
+                self.cache,
+                self.page_size,
+                self.diff_options,
+                self.path_filter,
+            )
+            self.report.outputs = []
+
+    def update(self, paths):
+        "Recompare the given relative paths and patch the report."
+        with self.lock:
+            click.echo(f"Updating comparison for {len(paths)} file(s)...")
+            start_time = time.time()
+            update_comparison(
+                self.report,
+                self.expected,
+                self.actual,
+                self.sensitivity,
+                paths,
+                self.cache,
+                self.diff_options,
+                self.report_dir,
+                self.path_filter,
+            )
+            write_report(self.report, self.report_dir, self.page_size)
+            self.report.outputs = []
+            duration = time.time() - start_time
+            click.echo(f"Comparison updated in {duration:.2f} seconds.")
+
+
+class ChangeHandler(FileSystemEventHandler):
+    "Coalesce file events and update the live report once they settle."
+
+    def __init__(self, live_report):
+        self.live_report = live_report
+        self.roots = [
+            Path(live_report.expected).resolve(),
+            Path(live_report.actual).resolve(),
+        ]
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.needs_refresh = False
+        self.timer = None
+
+    def relative_path(self, src_path):
+        "Return a path relative to the expected or actual directory."
+        path = Path(os.fsdecode(src_path)).resolve()
+        for root in self.roots:
+            try:
+                return path.relative_to(root)
+            except ValueError:
+                continue
+        return None
+
+    def on_any_event(self, event):
+        if event.event_type not in ["created", "deleted", "modified", "moved"]:
+            return
+        if event.is_directory and event.event_type == "modified":
+            return
+
+        click.echo(f"Event detected: {event.event_type} on {event.src_path}")
+        with self.lock:
+            if event.is_directory:
+                # Directory events can affect any number of files
+                self.needs_refresh = True
+            else:
+                for src_path in [event.src_path, getattr(event, "dest_path", "")]:
+                    path = src_path and self.relative_path(src_path)
+                    if path:
+                        self.pending.add(path)
+
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(DEBOUNCE_SECONDS, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        "Apply the events collected since the last flush."
+        with self.lock:
+            paths, self.pending = self.pending, set()
+            needs_refresh, self.needs_refresh = self.needs_refresh, False
+
+        if needs_refresh:
+            self.live_report.refresh()
+        elif paths:
+            self.live_report.update(paths)
 
 
 @click.command()
@@ -35,35 +185,54 @@ def write_comparison_with_timing(expected, actual, report_dir, sensitivity):
     default=8000,
     help="Port to run the server on (default is 8000).",
 )
-def serve(expected, actual, sensitivity, port):
+@click.option(
+    "--jobs",
+    default=1,
+    help="Number of worker processes used to compare files (default is 1).",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Reuse digests of unchanged files from previous runs (default is on).",
+)
+@click.option(
+    "--page-size",
+    default=0,
+    help="Load the HTML report in pages of N files (default is 0, no paging).",
+)
+@with_diff_options
+@with_filter_options
+def serve(
+    expected,
+    actual,
+    sensitivity,
+    port,
+    jobs,
+    cache,
+    page_size,
+    diff_options,
+    path_filter,
+):
     "Serve a web interface to view the comparison report."
 
-    class ChangeHandler(FileSystemEventHandler):
-        def __init__(self, expected, actual, report, sensitivity):
-            self.expected = expected
-            self.actual = actual
-            self.report = report
-            self.sensitivity = sensitivity
-
-        def on_any_event(self, event):
-            if (
-                event.event_type in ["deleted", "modified", "moved"]
-                and not event.is_directory
-            ):
-                click.echo(
-                    f"Event detected: {event.event_type} on file {event.src_path}"
-                )
-                write_comparison_with_timing(
-                    self.expected, self.actual, self.report, self.sensitivity
-                )
-
     with tempfile.TemporaryDirectory() as temp_output:
         report_dir = Path(temp_output)
+        live_report = LiveReport(
+            expected,
+            actual,
+            report_dir,
+            sensitivity,
+            jobs,
+            cache,
+            page_size,
+            diff_options,
+            path_filter,
+        )
 
         # Run initial comparison
-        write_comparison_with_timing(expected, actual, report_dir, sensitivity)
+        live_report.refresh()
 
-        handler = ChangeHandler(expected, actual, report_dir, sensitivity)
+        handler = ChangeHandler(live_report)
         observer = Observer()
         observer.schedule(handler, path=expected, recursive=True)
         observer.schedule(handler, path=actual, recursive=True)
@@ -75,9 +244,7 @@ def serve(expected, actual, sensitivity, port):
 
             def do_GET(self):
                 if self.path == "/run":
-                    write_comparison_with_timing(
-                        expected, actual, report_dir, sensitivity
-                    )
+                    live_report.refresh()
                     self.send_response(302)
                     self.send_header("Location", "/")
                     self.end_headers()
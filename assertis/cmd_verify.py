@@ -1,17 +1,32 @@
-import json
 import sys
 from pathlib import Path
 
 import click
 
-from assertis.md5_utils import md5_hash
-from assertis.models import AddedFile, ChangedFile, DeletedFile, Report, UnchangedFile
+from assertis.digest_cache import DigestCache
+from assertis.file_utils import is_selected
+from assertis.md5_utils import Digests
+from assertis.models import (
+    AddedFile,
+    ChangedFile,
+    DeletedFile,
+    UnchangedFile,
+    iter_report_files,
+    load_report,
+)
+from assertis.options import with_filter_options
 
 
 @click.command()
 @click.argument("expected")
 @click.argument("report")
-def verify(expected, report):
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Reuse digests of unchanged files from previous runs (default is on).",
+)
+@with_filter_options
+def verify(expected, report, cache, path_filter):
     "Verify the comparison report against the expected directory."
     report_dir = Path(report)
     expected_dir = Path(expected)
@@ -21,11 +36,18 @@ def verify(expected, report):
         click.echo(f"Report file {report_file} does not exist.", err=True)
         return
 
-    with open(report_file, "r") as f:
-        report_data = json.load(f)
-
-    report = Report(**report_data)
-    errors = verify_report(report, report_dir, expected_dir)
+    digests = Digests(DigestCache() if cache else None)
+    errors = verify_report(
+        (
+            file
+            for file in iter_report_files(report_dir)
+            if is_selected(file.name, path_filter)
+        ),
+        report_dir,
+        expected_dir,
+        digests,
+        load_report(report_dir).changes_only,
+    )
 
     if errors:
         for error in errors:
@@ -35,50 +57,71 @@ def verify(expected, report):
         click.echo("Verification successful. No errors found.")
 
 
-def should_exist(file_path, file_type, errors, expected_md5):
+def should_exist(file_path, file_type, errors, expected_md5, digests):
     "Check if a file should exist and its MD5 matches."
     if not Path(file_path).exists():
         errors.append(f"{file_type} file {file_path} is missing.")
-    elif md5_hash(file_path) != expected_md5:
+    elif digests.md5(file_path) != expected_md5:
         errors.append(f"{file_type} file {file_path} had an incorrect MD5.")
 
 
-def should_not_exist(file_path, file_type, errors):
-    "Check if a file should not exist."
-    if Path(file_path).exists():
-        errors.append(f"{file_type} file {file_path} should not exist.")
-
-
-def verify_report(report, report_dir, expected_dir):
-    "Verify the integrity of the comparison report."
+def verify_report(files, report_dir, expected_dir, digests=None, changes_only=False):
+    "Verify the integrity of the comparison report's file entries."
     errors = []
+    digests = digests or Digests()
+    # Report directories come and go, so their files stay out of the digest
+    # cache; only the expected tree is hashed again on later runs
+    report_digests = Digests()
 
-    for file in report.files:
+    for file in files:
         if isinstance(file, DeletedFile):
-            should_not_exist(report_dir / file.expected_file, "Report", errors)
+            # Deleted files are not copied to the report, so only the expected
+            # directory holds them until the report is applied
+            should_exist(
+                expected_dir / file.name,
+                "Expected",
+                errors,
+                file.expected_md5,
+                digests,
+            )
         elif isinstance(file, AddedFile):
             should_exist(
-                report_dir / file.actual_file, "Report", errors, file.actual_md5
+                report_dir / file.actual_file,
+                "Report",
+                errors,
+                file.actual_md5,
+                report_digests,
             )
         elif isinstance(file, ChangedFile):
             should_exist(
-                report_dir / file.expected_file, "Report", errors, file.expected_md5
+                report_dir / file.expected_file,
+                "Report",
+                errors,
+                file.expected_md5,
+                report_digests,
             )
             should_exist(
                 expected_dir / file.name,
                 "Expected",
                 errors,
                 file.expected_md5,
+                digests,
             )
         elif isinstance(file, UnchangedFile):
-            should_exist(
-                report_dir / file.expected_file, "Report", errors, file.expected_md5
-            )
+            if not changes_only:
+                should_exist(
+                    report_dir / file.expected_file,
+                    "Report",
+                    errors,
+                    file.expected_md5,
+                    report_digests,
+                )
             should_exist(
                 expected_dir / file.name,
                 "Expected",
                 errors,
                 file.expected_md5,
+                digests,
             )
 
     return errors
@@ -1,135 +1,436 @@
-import filecmp
+import asyncio
 import json
 import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
 from pathlib import Path
 
 import click
 from PIL import Image, ImageChops, ImageDraw
 
-from assertis.file_utils import glob
-from assertis.image_comparison import compare_images
-from assertis.md5_utils import md5_hash, md5_hash_image, md5_path
+from assertis.digest_cache import DigestCache
+from assertis.file_utils import (
+    glob,
+    in_shard,
+    is_image_file,
+    is_selected,
+    memory_file,
+)
+from assertis.image_comparison import compare_images, compare_metadata, encode_diff
+from assertis.md5_utils import Digests
 from assertis.models import (
+    NDJSON_FILES,
     AddedFile,
     ChangedFile,
     DeletedFile,
+    DiffOptions,
+    FileTiming,
+    MemoryFile,
     Output,
+    Profile,
     Report,
     UnchangedFile,
+    summarize_report,
+    timed,
 )
-from assertis.write import generate_html_report, write_report
+from assertis.write import generate_html_report, record_output, write_report
 
 
-def run_comparison(expected, actual, sensitivity):
-    "Run the comparison between expected and actual directories."
-    expected_dir = Path(expected)
-    actual_dir = Path(actual)
+def compare_path(
+    expected_dir,
+    actual_dir,
+    sensitivity,
+    diff_options,
+    digests,
+    path,
+    in_expected,
+    in_actual,
+):
+    "Compare a single relative path and return its report entry and outputs."
+    return compare_files(
+        str(path),
+        expected_dir / path if in_expected else None,
+        actual_dir / path if in_actual else None,
+        sensitivity,
+        diff_options,
+        digests,
+    )
 
-    report = Report()
 
-    expected_paths = glob(expected_dir)
-    actual_paths = glob(actual_dir)
+def compare_files(name, expected_path, actual_path, sensitivity, diff_options, digests):
+    "Compare two files, either of which may be missing, by report entry name."
+    outputs = []
+    timing = FileTiming(name=name)
+    hashed_bytes, hashed_seconds = digests.bytes_read, digests.seconds
 
-    for path in expected_paths:
-        if path not in actual_paths:
-            report.files.append(
-                DeletedFile(
-                    expected_md5=md5_hash(expected_dir / path),
-                    name=str(path),
-                    reasons=["Image deleted"],
-                )
+    if actual_path is None:
+        file = DeletedFile(
+            expected_md5=digests.md5(expected_path),
+            name=name,
+            reasons=["Image deleted"],
+        )
+    elif expected_path is None:
+        actual_file = digests.path(actual_path)
+        file = AddedFile(
+            actual_file=actual_file,
+            actual_md5=digests.md5(actual_path),
+            name=name,
+            reasons=["Image added"],
+        )
+        outputs.append(Output(filename=actual_file, content=actual_path))
+    elif digests.md5(expected_path) == digests.md5(actual_path):
+        actual_file = digests.path(actual_path)
+        file = UnchangedFile(
+            actual_file=actual_file,
+            actual_md5=digests.md5(actual_path),
+            expected_file=digests.path(expected_path),
+            expected_md5=digests.md5(expected_path),
+            name=name,
+            reasons=["Image unchanged"],
+        )
+        outputs.append(Output(filename=actual_file, content=actual_path))
+    else:
+        reasons = compare_metadata(
+            digests.metadata(expected_path), digests.metadata(actual_path)
+        )
+        if reasons:
+            identical, diff_image = False, None
+        else:
+            identical, diff_image, reasons = compare_images(
+                expected_path, actual_path, sensitivity, diff_options, timing
             )
-
-    for path in actual_paths:
-        expected_path = expected_dir / path
-        actual_path = actual_dir / path
-
-        if path not in expected_paths:
-            actual_file = md5_path(actual_path)
-            report.files.append(
-                AddedFile(
-                    actual_file=actual_file,
-                    actual_md5=md5_hash(actual_path),
-                    name=str(path),
-                    reasons=["Image added"],
-                )
+            timing.bytes_read += digests.size(expected_path) + digests.size(actual_path)
+        actual_file = digests.path(actual_path)
+        expected_file = digests.path(expected_path)
+        if identical:
+            file = UnchangedFile(
+                actual_file=actual_file,
+                actual_md5=digests.md5(actual_path),
+                expected_file=expected_file,
+                expected_md5=digests.md5(expected_path),
+                name=name,
+                reasons=["Image unchanged"],
             )
-            report.outputs.append(Output(filename=actual_file, content=actual_path))
         else:
-            if filecmp.cmp(expected_path, actual_path, shallow=False):
-                actual_file = md5_path(actual_path)
-                report.files.append(
-                    UnchangedFile(
-                        actual_file=actual_file,
-                        actual_md5=md5_hash(actual_path),
-                        expected_file=md5_path(expected_path),
-                        expected_md5=md5_hash(expected_path),
-                        name=str(path),
-                        reasons=["Image unchanged"],
-                    )
-                )
-                report.outputs.append(Output(filename=actual_file, content=actual_path))
-            else:
-                identical, diff_image, reasons = compare_images(
-                    expected_path, actual_path, sensitivity
+            diff_file = None
+            if diff_image:
+                # The encoded bytes are both hashed for the name and written
+                start = time.perf_counter()
+                diff = memory_file(
+                    "diff.png",
+                    encode_diff(
+                        diff_image, (diff_options or DiffOptions()).compress_level
+                    ),
                 )
-                if identical:
-                    actual_file = md5_path(actual_path)
-                    expected_file = md5_path(expected_path)
-                    report.files.append(
-                        UnchangedFile(
-                            actual_file=actual_file,
-                            expected_file=expected_file,
-                            md5_actual=md5_hash(actual_path),
-                            md5_expected=md5_hash(expected_path),
-                            name=str(path),
-                            reasons=["Image unchanged"],
-                        )
-                    )
-                    report.outputs.append(
-                        Output(filename=actual_file, content=actual_path)
-                    )
-                    report.outputs.append(
-                        Output(filename=expected_file, content=expected_path)
+                timing.encode_seconds += time.perf_counter() - start
+                diff_file = digests.path(diff)
+                outputs.append(Output(filename=diff_file, content=diff))
+            file = ChangedFile(
+                actual_file=actual_file,
+                actual_md5=digests.md5(actual_path),
+                diff_file=diff_file,
+                expected_file=expected_file,
+                expected_md5=digests.md5(expected_path),
+                name=name,
+                reasons=reasons,
+            )
+        outputs.append(Output(filename=actual_file, content=actual_path))
+        outputs.append(Output(filename=expected_file, content=expected_path))
+
+    timing.bytes_read += digests.bytes_read - hashed_bytes
+    timing.hash_seconds += digests.seconds - hashed_seconds
+    return file, outputs, timing
+
+
+def add_results(report, results, fail_fast=False, report_dir=None):
+    "Add comparison results to a report, collapsing outputs with the same name."
+    # Given a report directory, outputs are written as they arrive instead of
+    # being kept in the report until it is written
+    seen = {output.filename for output in report.outputs}
+    for file, outputs, timing in results:
+        if report.profile is not None:
+            report.profile.files.append(timing)
+        # Fail-fast reports only record the first difference
+        if fail_fast and file.type == "unchanged":
+            continue
+        report.files.append(file)
+        if report.changes_only and file.type == "unchanged":
+            continue
+        for output in outputs:
+            if output.filename in seen:
+                report.output_stats["skipped"] += 1
+                if isinstance(output.content, Path):
+                    report.output_stats["skipped_bytes"] += os.path.getsize(
+                        output.content
                     )
+                elif isinstance(output.content, MemoryFile):
+                    report.output_stats["skipped_bytes"] += len(output.content.data)
+            else:
+                seen.add(output.filename)
+                if report_dir is None:
+                    report.outputs.append(output)
                 else:
-                    diff_file = None
-                    if diff_image:
-                        md5_hash_value = md5_hash_image(diff_image)
-                        diff_file = f"{md5_hash_value}.png"
-                        report.outputs.append(
-                            Output(filename=diff_file, content=diff_image)
-                        )
-                    actual_file = md5_path(actual_path)
-                    expected_file = md5_path(expected_path)
-                    report.files.append(
-                        ChangedFile(
-                            actual_file=actual_file,
-                            actual_md5=md5_hash(actual_path),
-                            diff_file=diff_file,
-                            expected_file=expected_file,
-                            expected_md5=md5_hash(expected_path),
-                            name=str(path),
-                            reasons=reasons,
-                        )
-                    )
-                    report.outputs.append(
-                        Output(filename=actual_file, content=actual_path)
-                    )
-                    report.outputs.append(
-                        Output(filename=expected_file, content=expected_path)
-                    )
+                    start = time.perf_counter()
+                    record_output(report, output, report_dir)
+                    timing.write_seconds += time.perf_counter() - start
+        if fail_fast:
+            report.partial = True
+            return
+
+
+def sort_key(item):
+    type_order = {"changed": 0, "added": 1, "deleted": 2, "unchanged": 3}
+    return (type_order[item.type], item.name)
+
+
+def run_comparison(
+    expected,
+    actual,
+    sensitivity,
+    jobs=1,
+    cache=True,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    profile=False,
+    report_dir=None,
+    path_filter=None,
+    shard=None,
+):
+    "Run the comparison between expected and actual directories."
+    expected_dir = Path(expected)
+    actual_dir = Path(actual)
+
+    report = Report(
+        changes_only=changes_only,
+        profile=Profile() if profile else None,
+        shard="/".join(map(str, shard)) if shard else None,
+    )
+    if report_dir is not None:
+        # Outputs are streamed here before write_report runs
+        Path(report_dir).mkdir(parents=True, exist_ok=True)
+
+    with timed(report.profile, "glob"):
+        expected_paths = glob(expected_dir, path_filter, jobs)
+        actual_paths = glob(actual_dir, path_filter, jobs)
+    if shard:
+        # Shards depend on the path alone, so they partition the union
+        expected_paths = {path for path in expected_paths if in_shard(path, shard)}
+        actual_paths = {path for path in actual_paths if in_shard(path, shard)}
+    paths = sorted(expected_paths | actual_paths)
+    if fail_fast:
+        # Added and deleted files are differences that need no image comparison
+        paths = sorted(expected_paths ^ actual_paths) + sorted(
+            expected_paths & actual_paths
+        )
 
-    def sort_key(item):
-        type_order = {"changed": 0, "added": 1, "deleted": 2, "unchanged": 3}
-        return (type_order[item.type], item.name)
+    digests = Digests(DigestCache() if cache else None)
+    task = partial(
+        compare_path, expected_dir, actual_dir, sensitivity, diff_options, digests
+    )
+    in_expected = [path in expected_paths for path in paths]
+    in_actual = [path in actual_paths for path in paths]
+
+    with timed(report.profile, "compare"):
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                chunksize = max(1, len(paths) // (jobs * 4))
+                results = executor.map(
+                    task, paths, in_expected, in_actual, chunksize=chunksize
+                )
+                add_results(report, results, fail_fast, report_dir)
+                executor.shutdown(cancel_futures=True)
+        else:
+            results = map(task, paths, in_expected, in_actual)
+            add_results(report, results, fail_fast, report_dir)
+
+    if report.profile is not None and report_dir is not None:
+        # Outputs streamed during the comparison count as writing them
+        written = sum(timing.write_seconds for timing in report.profile.files)
+        report.profile.stages["compare"] -= written
+        report.profile.stages["write_outputs"] = written
+
+    report.files.sort(key=sort_key)
+    return report
+
+
+async def iter_comparison_async(
+    expected,
+    actual,
+    sensitivity,
+    jobs=1,
+    cache=True,
+    diff_options=None,
+    path_filter=None,
+):
+    "Compare directories off the event loop, yielding results as they complete."
+    expected_dir = Path(expected)
+    actual_dir = Path(actual)
+
+    expected_paths, actual_paths = await asyncio.gather(
+        asyncio.to_thread(glob, expected_dir, path_filter, jobs),
+        asyncio.to_thread(glob, actual_dir, path_filter, jobs),
+    )
+    paths = sorted(expected_paths | actual_paths)
+
+    digests = Digests(DigestCache() if cache else None)
+    task = partial(
+        compare_path, expected_dir, actual_dir, sensitivity, diff_options, digests
+    )
+
+    # A single thread keeps the serial case off the event loop without the
+    # cost of starting worker processes
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    futures = [
+        loop.run_in_executor(
+            executor, task, path, path in expected_paths, path in actual_paths
+        )
+        for path in paths
+    ]
+    try:
+        for future in asyncio.as_completed(futures):
+            yield await future
+    finally:
+        # Closing the iterator early drops comparisons that have not started
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_memory_comparison(
+    expected,
+    actual,
+    sensitivity,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    path_filter=None,
+):
+    "Compare mappings of names to in-memory images without touching the disk."
+    expected = {
+        name: memory_file(name, value)
+        for name, value in expected.items()
+        if is_selected(name, path_filter)
+    }
+    actual = {
+        name: memory_file(name, value)
+        for name, value in actual.items()
+        if is_selected(name, path_filter)
+    }
+
+    report = Report(changes_only=changes_only)
+
+    names = sorted(expected.keys() | actual.keys())
+    if fail_fast:
+        names = sorted(expected.keys() ^ actual.keys()) + sorted(
+            expected.keys() & actual.keys()
+        )
+
+    digests = Digests()
+    results = (
+        compare_files(
+            name,
+            expected.get(name),
+            actual.get(name),
+            sensitivity,
+            diff_options,
+            digests,
+        )
+        for name in names
+    )
+    add_results(report, results, fail_fast=fail_fast)
+
+    report.files.sort(key=sort_key)
+    return summarize_report(report)
+
+
+def update_comparison(
+    report,
+    expected,
+    actual,
+    sensitivity,
+    paths,
+    cache=True,
+    diff_options=None,
+    report_dir=None,
+    path_filter=None,
+):
+    "Recompare the given relative paths and patch the results into a report."
+    expected_dir = Path(expected)
+    actual_dir = Path(actual)
+    paths = sorted({Path(path) for path in paths})
+    names = {str(path) for path in paths}
+
+    digests = Digests(DigestCache() if cache else None)
+    report.files = [file for file in report.files if file.name not in names]
+    report.outputs = []
+    report.output_stats = defaultdict(int)
+
+    results = []
+    for path in paths:
+        selected = is_selected(path, path_filter)
+        in_expected = selected and is_image_file(expected_dir / path)
+        in_actual = selected and is_image_file(actual_dir / path)
+        if in_expected or in_actual:
+            results.append(
+                compare_path(
+                    expected_dir,
+                    actual_dir,
+                    sensitivity,
+                    diff_options,
+                    digests,
+                    path,
+                    in_expected,
+                    in_actual,
+                )
+            )
+    add_results(report, results, report_dir=report_dir)
 
     report.files.sort(key=sort_key)
     return report
 
 
-def write_comparison(expected, actual, report_dir, sensitivity):
-    report = run_comparison(expected, actual, sensitivity)
-    write_report(report, Path(report_dir))
+def write_comparison(
+    expected,
+    actual,
+    report_dir,
+    sensitivity,
+    jobs=1,
+    cache=True,
+    report_format="json",
+    page_size=0,
+    diff_options=None,
+    fail_fast=False,
+    changes_only=False,
+    profile=False,
+    path_filter=None,
+    shard=None,
+):
+    report_dir = Path(report_dir)
+    report = run_comparison(
+        expected,
+        actual,
+        sensitivity,
+        jobs,
+        cache,
+        diff_options=diff_options,
+        fail_fast=fail_fast,
+        changes_only=changes_only,
+        profile=profile,
+        report_dir=report_dir,
+        path_filter=path_filter,
+        shard=shard,
+    )
+    if report_format == "ndjson":
+        # Entries go to NDJSON in report order. The writer still holds every
+        # entry in memory; readers like fix and verify stream them.
+        report.files_file = NDJSON_FILES
+    write_report(report, report_dir, page_size)
     return report
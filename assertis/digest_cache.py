@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+# Files modified this recently may still be written to within the same
+# timestamp tick, so their digests are not cached.
+RACY_WINDOW_NS = 2 * 1_000_000_000
+
+# Rows are pruned at most once a day, dropping entries for files that no
+# longer exist and entries that have not been looked up for a month
+SWEEP_INTERVAL = 24 * 60 * 60
+MAX_UNUSED_SECONDS = 30 * 24 * 60 * 60
+
+# Bumped when the table changes; older caches are dropped and rebuilt
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    format TEXT,
+    mode TEXT,
+    width INTEGER,
+    height INTEGER,
+    used_at INTEGER NOT NULL
+)
+"""
+
+
+def default_cache_path():
+    "Return the location of the digest cache for this user."
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "assertis" / "digests.sqlite3"
+
+
+def stat_key(stat):
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class DigestCache:
+    "An SQLite cache of file MD5s and image metadata keyed by stat information."
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_cache_path()
+        self.connection = None
+        self.disabled = False
+
+    def __getstate__(self):
+        # Connections can't be pickled; each worker process opens its own.
+        return {"path": self.path, "connection": None, "disabled": self.disabled}
+
+    def connect(self):
+        "Open the cache database, disabling the cache if that isn't possible."
+        if self.connection is None and not self.disabled:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.connection = sqlite3.connect(self.path, timeout=30)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+                self.migrate()
+                self.sweep()
+            except (OSError, sqlite3.Error):
+                self.connection = None
+                self.disabled = True
+        return self.connection
+
+    def migrate(self):
+        "Create the table, dropping one written by an older version."
+        with self.connection:
+            (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+            if version != SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS digests")
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.execute(SCHEMA)
+
+    def sweep(self):
+        "Prune rows of deleted or long unused files, if a day has passed."
+        marker = self.path.with_name(self.path.name + ".swept")
+        now = time.time()
+        try:
+            if now - marker.stat().st_mtime < SWEEP_INTERVAL:
+                return
+        except FileNotFoundError:
+            pass
+        # Touch first so that concurrent workers don't sweep as well
+        marker.touch()
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM digests WHERE used_at < ?",
+                (int(now - MAX_UNUSED_SECONDS),),
+            )
+            missing = [
+                (path,)
+                for (path,) in self.connection.execute("SELECT path FROM digests")
+                if not os.path.exists(path)
+            ]
+            self.connection.executemany("DELETE FROM digests WHERE path = ?", missing)
+
+    def get(self, path, stat):
+        "Return the cached (md5, metadata) of a file, or None if missing or stale."
+        connection = self.connect()
+        if connection is None:
+            return None
+        path = Path(path).resolve()
+        row = connection.execute(
+            "SELECT size, mtime_ns, inode, md5, format, mode, width, height, used_at "
+            "FROM digests WHERE path = ?",
+            (str(path),),
+        ).fetchone()
+        if row is None or tuple(row[:3]) != stat_key(stat):
+            return None
+        md5, image_format, mode, width, height, used_at = row[3:]
+        # Only refresh the last use once a day to keep lookups read-only
+        now = int(time.time())
+        if now - used_at > SWEEP_INTERVAL:
+            with connection:
+                connection.execute(
+                    "UPDATE digests SET used_at = ? WHERE path = ?", (now, str(path))
+                )
+        metadata = None
+        if mode is not None:
+            metadata = (image_format, mode, (width, height))
+        return md5, metadata
+
+    def put(self, path, stat, md5, metadata=None):
+        "Store the digest of a file whose contents were read at the given stat."
+        connection = self.connect()
+        if connection is None:
+            return
+        path = Path(path).resolve()
+        if stat_key(os.stat(path)) != stat_key(stat):
+            return
+        if time.time_ns() - stat.st_mtime_ns < RACY_WINDOW_NS:
+            return
+        image_format, mode, (width, height) = metadata or (None, None, (None, None))
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO digests "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    *stat_key(stat),
+                    md5,
+                    image_format,
+                    mode,
+                    width,
+                    height,
+                    int(time.time()),
+                ),
+            )
@@ -1,7 +1,21 @@
+import fnmatch
+import hashlib
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
 from pathlib import Path
 
 from PIL import Image
 
+from assertis.models import MemoryFile, PathFilter
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
 exts = Image.registered_extensions()
 supported_extensions = {ex for ex, f in exts.items() if f in Image.OPEN}
 
@@ -9,12 +23,141 @@ supported_extensions = {ex for ex, f in exts.items() if f in Image.OPEN}
 import os
 
 
-def glob(directory):
-    "Recursively find all supported image files in a directory."
+def is_image_file(path):
+    "Check whether a path is an existing file with a supported image extension."
+    path = Path(path)
+    return path.suffix.lower() in supported_extensions and path.is_file()
+
+
+@lru_cache
+def path_matcher(patterns):
+    "Return a function telling whether a path or its name matches any pattern."
+    names = [fnmatch.translate(p) for p in patterns if "/" not in p]
+    paths = [fnmatch.translate(p.strip("/")) for p in patterns if "/" in p]
+    name_regex = re.compile("|".join(names)) if names else None
+    path_regex = re.compile("|".join(paths)) if paths else None
+
+    def matches(relative, name):
+        return bool(
+            (name_regex and name_regex.match(name))
+            or (path_regex and path_regex.match(relative))
+        )
+
+    return matches if patterns else None
+
+
+def is_selected(path, path_filter=None):
+    "Check whether a relative path passes the include and exclude patterns."
+    if path_filter is None:
+        return True
+    include = path_matcher(tuple(path_filter.include))
+    exclude = path_matcher(tuple(path_filter.exclude))
+    parts = Path(path).parts
+    prefixes = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+    if exclude and any(map(exclude, prefixes, parts)):
+        return False
+    return not include or any(map(include, prefixes, parts))
+
+
+def in_shard(path, shard):
+    "Check whether a relative path falls in a (1-based index, count) shard."
+    index, count = shard
+    # A stable hash, so that every machine partitions the paths the same way
+    digest = hashlib.md5(Path(path).as_posix().encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+
+def scan_directory(root, include, exclude, relative, included):
+    "List the image files and the subdirectories to walk of one directory."
+    files, subdirectories = [], []
+    with os.scandir(os.path.join(root, relative)) as entries:
+        for entry in entries:
+            path = f"{relative}/{entry.name}" if relative else entry.name
+            if exclude and exclude(path, entry.name):
+                continue
+            # Directory entry types are cached, so this is usually free of stat
+            # calls; directory symlinks are not followed, like Path.rglob
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append((path, included or include(path, entry.name)))
+            elif (
+                os.path.splitext(entry.name)[1].lower() in supported_extensions
+                and entry.is_file()
+                and (included or include(path, entry.name))
+            ):
+                files.append(path)
+    return files, subdirectories
+
+
+def glob(directory, path_filter=None, jobs=1):
+    "Recursively find the supported image files in a directory, relative to it."
     if not os.path.exists(directory):
         raise FileNotFoundError(f"The directory {directory} does not exist.")
-    return {
-        f.relative_to(directory)
-        for f in Path(directory).rglob("*")
-        if f.is_file() and f.suffix.lower() in supported_extensions
-    }
+    path_filter = path_filter or PathFilter()
+    include = path_matcher(tuple(path_filter.include))
+    exclude = path_matcher(tuple(path_filter.exclude))
+    scan = partial(scan_directory, directory, include, exclude)
+
+    # Walk one level at a time so that directories of a level can be listed
+    # in parallel; files under an included directory are all included
+    found = []
+    level = [("", include is None)]
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        while level:
+            results = (executor.map if executor else map)(scan, *zip(*level))
+            level = []
+            for files, subdirectories in results:
+                found.extend(files)
+                level.extend(subdirectories)
+    finally:
+        if executor:
+            executor.shutdown()
+    return {Path(path) for path in found}
+
+
+def memory_file(name, value):
+    "Wrap a PIL image, bytes or binary buffer as an in-memory image file."
+    if isinstance(value, Image.Image):
+        # Images without an encoding are stored losslessly as PNG
+        buffer = BytesIO()
+        value.save(buffer, format="PNG")
+        data, suffix = buffer.getvalue(), ".png"
+    elif hasattr(value, "read"):
+        data, suffix = value.read(), Path(name).suffix
+    else:
+        data, suffix = bytes(value), Path(name).suffix
+    return MemoryFile(data=data, md5=hashlib.md5(data).hexdigest(), suffix=suffix)
+
+
+# ioctl request to clone a file's extents (reflink) on Linux
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def copy_file(source, target):
+    "Copy a file, reflinking or copying in the kernel where the filesystem allows."
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return
+            except OSError:
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst)
+
+
+def link_file(source, target):
+    "Hardlink a file, copying it where the filesystem can't link it."
+    try:
+        os.link(source, target)
+    except OSError:
+        copy_file(source, target)
@@ -1,42 +1,236 @@
-from PIL import Image, ImageChops
+import time
+from functools import reduce
+from io import BytesIO
 
+from PIL import Image, ImageChops, ImageFilter, ImageMath
 
-def compare_images(img1_path, img2_path, sensitivity):
-    "Compare two images and highlight differences."
-    img1 = Image.open(img1_path)
-    img2 = Image.open(img2_path)
+from assertis.models import DiffOptions, MemoryFile
+
+# Palette of encoded diffs: index 0 is transparent, index 1 marks changes
+DIFF_PALETTE = [0, 0, 0, 255, 0, 0]
+
+# Largest possible YIQ delta between two colors, as used by pixelmatch
+MAX_YIQ_DELTA = 35215
+
+
+def open_image(path):
+    "Open an image from a path or an in-memory file."
+    if isinstance(path, MemoryFile):
+        return Image.open(BytesIO(path.data))
+    return Image.open(path)
+
+
+def image_metadata(path):
+    "Read the format, mode and size of an image without decoding its pixels."
+    with open_image(path) as img:
+        return img.format, img.mode, img.size
+
+
+def compare_metadata(metadata1, metadata2):
+    "Return the reasons two images differ in format, mode or size."
+    (format1, mode1, size1), (format2, mode2, size2) = metadata1, metadata2
     reasons = []
 
-    if img1.format != img2.format:
-        reasons.append(f"Format changed from {img1.format} to {img2.format}")
-    if img1.mode != img2.mode:
-        reasons.append(f"Mode changed from {img1.mode} to {img2.mode}")
-    if img1.size != img2.size:
-        reasons.append(f"Size changed from {img1.size} to {img2.size}")
+    if format1 != format2:
+        reasons.append(f"Format changed from {format1} to {format2}")
+    if mode1 != mode2:
+        reasons.append(f"Mode changed from {mode1} to {mode2}")
+    if size1 != size2:
+        reasons.append(f"Size changed from {size1} to {size2}")
+
+    return reasons
+
+
+def tile_boxes(size, tile_size):
+    "Split an image size into (left, top, right, bottom) tiles."
+    width, height = size
+    tile_width = tile_size or width
+    tile_height = tile_size or height
+    for top in range(0, height, tile_height):
+        for left in range(0, width, tile_width):
+            yield (
+                left,
+                top,
+                min(left + tile_width, width),
+                min(top + tile_height, height),
+            )
+
+
+def binarize(mask, threshold):
+    "Turn a grayscale mask into 255 where it exceeds the threshold and 0 elsewhere."
+    return mask.point(lambda value: 255 if value > threshold else 0)
+
+
+def max_band(image):
+    "Collapse a multi-band image into its per-pixel maximum."
+    return reduce(ImageChops.lighter, image.split())
+
+
+def to_rgb(image):
+    "Convert an image to RGB, blending any transparency onto white."
+    if image.mode == "RGB":
+        return image
+    image = image.convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, image).convert("RGB")
+
+
+def gray_mask(img1, img2, threshold):
+    "Mask pixels whose grayscale difference exceeds the threshold."
+    return binarize(ImageChops.difference(img1, img2).convert("L"), threshold)
+
+
+def channel_mask(img1, img2, threshold):
+    "Mask pixels where any channel differs by more than its threshold."
+    if not isinstance(threshold, tuple):
+        return binarize(max_band(ImageChops.difference(img1, img2)), threshold)
+
+    # Alpha must match exactly unless it has a threshold of its own
+    thresholds = threshold + (0,) * (4 - len(threshold))
+    bands = ImageChops.difference(img1.convert("RGBA"), img2.convert("RGBA")).split()
+    return reduce(
+        ImageChops.lighter,
+        [binarize(band, limit) for band, limit in zip(bands, thresholds)],
+    )
+
+
+def yiq_mask(img1, img2, threshold):
+    "Mask pixels whose perceptual YIQ color difference exceeds the threshold."
+    bands = [band.convert("F") for band in to_rgb(img1).split() + to_rgb(img2).split()]
+    delta = ImageMath.lambda_eval(yiq_delta, **dict(zip("rgbRGB", bands)))
+    # Scale the threshold so that 255 corresponds to the largest possible delta
+    limit = MAX_YIQ_DELTA * (threshold / 255) ** 2
+    return ImageMath.lambda_eval(
+        lambda args: (args["delta"] > limit) * 255, delta=delta
+    ).convert("L")
+
+
+def yiq_delta(args):
+    "The squared YIQ distance used by pixelmatch, computed on float bands."
+    dr, dg, db = args["r"] - args["R"], args["g"] - args["G"], args["b"] - args["B"]
+    y = dr * 0.29889531 + dg * 0.58662247 + db * 0.11448223
+    i = dr * 0.59597799 - dg * 0.27417610 - db * 0.32180189
+    q = dr * 0.21147017 - dg * 0.52261711 + db * 0.31114694
+    return y * y * 0.5053 + i * i * 0.299 + q * q * 0.1957
+
+
+def antialiased_mask(img1, img2):
+    "Mask pixels whose value in each image lies within the other's 3x3 neighborhood."
+
+    def within_neighborhood(image, other):
+        low = other.filter(ImageFilter.MinFilter(3))
+        high = other.filter(ImageFilter.MaxFilter(3))
+        outside = ImageChops.lighter(
+            ImageChops.subtract(low, image), ImageChops.subtract(image, high)
+        )
+        return max_band(outside).point(lambda value: 255 if value == 0 else 0)
+
+    return ImageChops.multiply(
+        within_neighborhood(img1, img2), within_neighborhood(img2, img1)
+    )
+
+
+def changed_mask(img1, img2, options):
+    "Return a mask that is 255 where the images differ beyond the tolerances."
+    if options.metric != "gray" or options.ignore_antialiasing:
+        if img1.mode not in ("L", "RGB", "RGBA"):
+            img1, img2 = img1.convert("RGBA"), img2.convert("RGBA")
+
+    if options.metric == "yiq":
+        mask = yiq_mask(img1, img2, options.threshold)
+    elif options.metric == "channel":
+        mask = channel_mask(img1, img2, options.threshold)
+    else:
+        mask = gray_mask(img1, img2, options.threshold)
+
+    if options.ignore_antialiasing and mask.getbbox():
+        mask = ImageChops.subtract(mask, antialiased_mask(img1, img2))
+    return mask
+
+
+def expand_box(box, margin, size):
+    "Grow a box by a margin on each side without leaving the image."
+    left, top, right, bottom = box
+    width, height = size
+    return (
+        max(left - margin, 0),
+        max(top - margin, 0),
+        min(right + margin, width),
+        min(bottom + margin, height),
+    )
+
+
+def compare_images(img1_path, img2_path, sensitivity, options=None, timing=None):
+    "Compare two images and highlight differences."
+    options = options or DiffOptions()
+    img1 = open_image(img1_path)
+    img2 = open_image(img2_path)
+    reasons = compare_metadata(
+        (img1.format, img1.mode, img1.size), (img2.format, img2.mode, img2.size)
+    )
 
     if reasons:
         return False, None, reasons
 
-    # Calculate the difference between the images
-    diff = ImageChops.difference(img1, img2)
+    # Decode up front so that decoding and diffing are timed separately
+    start = time.perf_counter()
+    img1.load()
+    img2.load()
+    decoded = time.perf_counter()
+
+    # Anti-aliasing detection looks one pixel past the edges of each tile
+    margin = 1 if options.ignore_antialiasing else 0
+    diff_mask = None
+    changed_pixels = 0
 
-    # Convert the difference image to grayscale
-    diff_mask = diff.convert("L")
+    # Diff one tile at a time so temporary images are bounded by the tile size,
+    # leaving the decoded sources and the one byte per pixel mask full size
+    for box in tile_boxes(img1.size, options.tile_size):
+        if options.tile_size:
+            outer = expand_box(box, margin, img1.size)
+            mask = changed_mask(img1.crop(outer), img2.crop(outer), options)
+            if outer != box:
+                left, top = box[0] - outer[0], box[1] - outer[1]
+                mask = mask.crop(
+                    (left, top, left + box[2] - box[0], top + box[3] - box[1])
+                )
+        else:
+            mask = changed_mask(img1, img2, options)
 
-    # Create an RGBA image to highlight the differences
-    diff_highlight = Image.new("RGBA", img1.size, (0, 0, 0, 0))
-    threshold = 0  # You can adjust the threshold to control sensitivity
+        # Tiles that differ only in encoding, metadata or within the
+        # tolerances have no changed pixels
+        if mask.getbbox() is None:
+            continue
 
-    # Highlight the changed pixels in red
-    for x in range(diff.width):
-        for y in range(diff.height):
-            if diff_mask.getpixel((x, y)) > threshold:
-                diff_highlight.putpixel((x, y), (255, 0, 0, 255))  # Highlight in red
+        changed_pixels += mask.histogram()[255]
+
+        # Mark the changed pixels with the palette entry that shows them red
+        if diff_mask is None:
+            diff_mask = Image.new("P", img1.size, 0)
+            diff_mask.putpalette(DIFF_PALETTE)
+            diff_mask.info["transparency"] = 0
+        diff_mask.paste(1, box, mask=mask)
+
+    if timing is not None:
+        timing.decode_seconds += decoded - start
+        timing.diff_seconds += time.perf_counter() - decoded
+
+    # No pixel differs beyond the tolerances
+    if diff_mask is None:
+        return True, None, ["Pixels unchanged"]
 
     # Calculate the extent of the change as a percentage of total pixels
     total_pixels = img1.size[0] * img1.size[1]
-    changed_pixels = sum(1 for pixel in diff_mask.getdata() if pixel > threshold)
     change_extent = (changed_pixels / total_pixels) * 100
     reasons.append(f"Pixels changed with extent {change_extent:.2f}%")
 
-    return change_extent <= sensitivity, diff_highlight, reasons
+    return change_extent <= sensitivity, diff_mask, reasons
+
+
+def encode_diff(diff_mask, compress_level=1):
+    "Encode a diff mask once, as a 1-bit palettized PNG, and return its bytes."
+    buffer = BytesIO()
+    diff_mask.save(
+        buffer, format="PNG", bits=1, transparency=0, compress_level=compress_level
+    )
+    return buffer.getvalue()
@@ -1,26 +1,78 @@
 import hashlib
-from io import BytesIO
+import os
+import time
+from pathlib import Path
 
-from PIL import Image
+from assertis.image_comparison import image_metadata
+from assertis.models import MemoryFile
+
+CHUNK_SIZE = 1024 * 1024
 
 
 def md5_hash(file_path):
     "Compute the MD5 hash of a file."
     hasher = hashlib.md5()
     with open(file_path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
     return hasher.hexdigest()
 
 
-def md5_hash_image(image):
-    "Compute the MD5 hash of an image."
-    hasher = hashlib.md5()
-    with BytesIO() as output:
-        image.save(output, format="PNG")
-        hasher.update(output.getvalue())
-    return hasher.hexdigest()
+class Digests:
+    "Memoize file MD5s so that each input file is read once per run."
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.stats = {}
+        self.md5s = {}
+        self.metadatas = {}
+        # Running totals of the work done on cache misses, for profiling
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def md5(self, path):
+        "Return the MD5 of a file, hashing it on first use."
+        if isinstance(path, MemoryFile):
+            return path.md5
+        path = Path(path)
+        if path not in self.md5s:
+            self.stats[path] = stat = os.stat(path)
+            cached = self.cache.get(path, stat) if self.cache else None
+            if cached:
+                self.md5s[path], metadata = cached
+                if metadata:
+                    self.metadatas[path] = metadata
+            else:
+                start = time.perf_counter()
+                self.md5s[path] = md5_hash(path)
+                self.seconds += time.perf_counter() - start
+                self.bytes_read += stat.st_size
+                if self.cache:
+                    self.cache.put(path, stat, self.md5s[path])
+        return self.md5s[path]
+
+    def metadata(self, path):
+        "Return the (format, mode, size) of an image, reading it on first use."
+        if isinstance(path, MemoryFile):
+            return image_metadata(path)
+        path = Path(path)
+        md5 = self.md5(path)
+        if path not in self.metadatas:
+            start = time.perf_counter()
+            self.metadatas[path] = image_metadata(path)
+            self.seconds += time.perf_counter() - start
+            if self.cache:
+                self.cache.put(path, self.stats[path], md5, self.metadatas[path])
+        return self.metadatas[path]
 
+    def size(self, path):
+        "Return the size in bytes of a file that has been hashed."
+        if isinstance(path, MemoryFile):
+            return len(path.data)
+        self.md5(path)
+        return self.stats[Path(path)].st_size
 
-def md5_path(path):
-    return f"{md5_hash(path)}{path.suffix}"
+    def path(self, path):
+        "Return the content-addressed filename of a file."
+        suffix = path.suffix if isinstance(path, MemoryFile) else Path(path).suffix
+        return f"{self.md5(path)}{suffix}"
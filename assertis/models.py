@@ -1,17 +1,60 @@
+import json
 import shlex
+import time
 from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Literal, Optional, Union
+from typing import Annotated, Dict, List, Literal, Optional, Tuple, Union
 
 import click
-from PIL import Image
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
+
+# Name of the line-delimited file entries of a streamed report
+NDJSON_FILES = "files.ndjson"
+
+
+class MemoryFile(BaseModel):
+    "An image file held in memory instead of on disk."
+
+    data: bytes
+    md5: str
+    suffix: str
 
 
 class Output(BaseModel):
     filename: str
-    content: Union[Image.Image, Path]
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+    content: Union[Path, MemoryFile]
+
+
+class DiffOptions(BaseModel, extra="forbid"):
+    metric: Literal["gray", "channel", "yiq"] = "gray"
+    # One threshold for every channel, or R,G,B[,A] for the channel metric
+    threshold: Union[int, Tuple[int, ...]] = 0
+    ignore_antialiasing: bool = False
+    tile_size: int = Field(0, ge=0)
+    # zlib level of the diff PNGs; their 1-bit masks compress well even at 1
+    compress_level: int = Field(1, ge=0, le=9)
+
+    @model_validator(mode="after")
+    def check_threshold(self):
+        thresholds = self.threshold
+        if isinstance(thresholds, tuple):
+            if self.metric != "channel":
+                raise ValueError("Per-channel thresholds need the channel metric.")
+            if len(thresholds) not in (3, 4):
+                raise ValueError("Per-channel thresholds take R,G,B or R,G,B,A.")
+        else:
+            thresholds = (thresholds,)
+        if not all(0 <= threshold <= 255 for threshold in thresholds):
+            raise ValueError("Thresholds must be between 0 and 255.")
+        return self
+
+
+class PathFilter(BaseModel, extra="forbid"):
+    # Glob patterns without a slash match the name of any path component, like
+    # in .gitignore, and the others match the whole relative path
+    include: List[str] = []
+    exclude: List[str] = []
 
 
 class BaseFile(BaseModel, extra="forbid"):
@@ -47,21 +90,116 @@ class UnchangedFile(BaseFile, extra="forbid"):
     type: Literal["unchanged"] = "unchanged"
 
 
+FileEntry = Annotated[
+    Union[AddedFile, DeletedFile, ChangedFile, UnchangedFile],
+    Field(discriminator="type"),
+]
+file_entry_adapter = TypeAdapter(FileEntry)
+
+
+class FileTiming(BaseModel, extra="forbid"):
+    name: str
+    bytes_read: int = 0
+    hash_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    diff_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    write_seconds: float = 0.0
+
+    @property
+    def total_seconds(self):
+        return (
+            self.hash_seconds
+            + self.decode_seconds
+            + self.diff_seconds
+            + self.encode_seconds
+            + self.write_seconds
+        )
+
+
+class Profile(BaseModel, extra="forbid"):
+    # Wall-clock seconds of each stage of the run, in order
+    stages: Dict[str, float] = Field(default_factory=dict)
+    files: List[FileTiming] = Field(default_factory=list)
+
+
+@contextmanager
+def timed(profile, stage):
+    "Add the wall-clock time of a block to a profile stage, if profiling."
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            elapsed = time.perf_counter() - start
+            profile.stages[stage] = profile.stages.get(stage, 0.0) + elapsed
+
+
 class Report(BaseModel, extra="forbid"):
     outputs: List[Output] = Field(default_factory=list)
-    files: List[Union[AddedFile, DeletedFile, ChangedFile, UnchangedFile]] = Field(
-        default_factory=list
-    )
+    files: List[FileEntry] = Field(default_factory=list)
+    files_file: Optional[str] = None
+    partial: bool = False
+    # Unchanged files keep their MD5s but are not copied to the report directory
+    changes_only: bool = False
     has_changes: bool = False
     summary: Dict[str, int] = Field(default_factory=lambda: defaultdict(int))
+    output_stats: Dict[str, int] = Field(default_factory=lambda: defaultdict(int))
+    profile: Optional[Profile] = None
+    # "INDEX/COUNT" of a sharded comparison
+    shard: Optional[str] = None
+
+
+def load_report(report_dir):
+    "Load report.json, which holds no file entries if they were streamed to NDJSON."
+    with open(Path(report_dir) / "report.json", "r") as f:
+        return Report(**json.load(f))
+
+
+def iter_report_files(report_dir):
+    "Yield the file entries of a report, streaming them from NDJSON if possible."
+    report_dir = Path(report_dir)
+    report = load_report(report_dir)
+
+    if report.files_file is None:
+        yield from report.files
+        return
+
+    with open(report_dir / report.files_file, "r") as f:
+        for line in f:
+            if line.strip():
+                yield file_entry_adapter.validate_json(line)
+
 
+def summarize_report(report: Report) -> Report:
+    "Count the files of each type and record whether anything changed."
+    # Initialize summary with all possible keys
+    report.summary = {
+        "added": 0,
+        "changed": 0,
+        "unchanged": 0,
+        "deleted": 0,
+    }
 
-def report_to_string(report: Report, report_dir: str, expected_dir: str) -> str:
+    for file in report.files:
+        report.summary[file.type] += 1
+
+    report.has_changes = bool(
+        report.summary["added"]
+        or report.summary["changed"]
+        or report.summary["deleted"]
+    )
+    return report
+
+
+def report_to_string(
+    report: Report, report_dir: str, expected_dir: Optional[str] = None
+) -> str:
     "Convert the report object to a formatted string."
     result = []
     # Absolutize the paths
     abs_report_dir = str(Path(report_dir).resolve())
-    abs_expected_dir = str(Path(expected_dir).resolve())
+    abs_expected_dir = str(Path(expected_dir).resolve()) if expected_dir else None
 
     if report.has_changes:
         summary_parts = [
@@ -71,15 +209,56 @@ def report_to_string(report: Report, report_dir: str, expected_dir: str) -> str:
         result.append(f"Comparison failed ({summary_str}).")
 
         # Add the 'fix' command suggestion
-        quoted_expected = shlex.quote(abs_expected_dir)
+        # Merged reports don't know the expected directory
+        quoted_expected = (
+            shlex.quote(abs_expected_dir) if abs_expected_dir else "EXPECTED_DIR"
+        )
         quoted_report = shlex.quote(abs_report_dir)
         fix_command = f"python -m assertis fix {quoted_expected} {quoted_report}"
         result.append(f"\nTo apply these changes to the expected directory, run:")
         result.append(f"  {fix_command}")
     else:
         result.append("Comparison passed.")
+    if report.output_stats:
+        stats = defaultdict(int, report.output_stats)
+        result.append(
+            f"\nOutputs: {stats['written']} written ({stats['written_bytes']} bytes), "
+            f"{stats['skipped']} skipped ({stats['skipped_bytes']} bytes)."
+        )
+    if report.partial:
+        result.append(
+            "\nStopped at the first difference. "
+            "Run the comparison without --fail-fast for the full report."
+        )
+    if report.profile is not None:
+        result.append("\n" + profile_to_string(report.profile))
     result.append("\nFiles:")
     for file in report.files:
         result.append(f"  {file.name}: {'; '.join(file.reasons)}")
     result.append(f"\nReport is in the directory: {abs_report_dir}")
     return "\n".join(result)
+
+
+def profile_to_string(profile: Profile, slowest: int = 10) -> str:
+    "Format the stage timings and the slowest pairs of a profile."
+    files = profile.files
+    result = ["Profile:"]
+    for stage, seconds in profile.stages.items():
+        result.append(f"  {stage}: {seconds:.3f}s")
+    result.append(
+        f"  {len(files)} files, {sum(f.bytes_read for f in files)} bytes read, "
+        f"hash {sum(f.hash_seconds for f in files):.3f}s, "
+        f"decode {sum(f.decode_seconds for f in files):.3f}s, "
+        f"diff {sum(f.diff_seconds for f in files):.3f}s, "
+        f"encode {sum(f.encode_seconds for f in files):.3f}s, "
+        f"write {sum(f.write_seconds for f in files):.3f}s"
+    )
+    result.append("\nSlowest pairs:")
+    for f in sorted(files, key=lambda f: f.total_seconds, reverse=True)[:slowest]:
+        result.append(
+            f"  {f.name}: {f.total_seconds:.3f}s (hash {f.hash_seconds:.3f}s, "
+            f"decode {f.decode_seconds:.3f}s, diff {f.diff_seconds:.3f}s, "
+            f"encode {f.encode_seconds:.3f}s, write {f.write_seconds:.3f}s, "
+            f"{f.bytes_read} bytes)"
+        )
+    return "\n".join(result)
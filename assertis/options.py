@@ -0,0 +1,109 @@
+from functools import wraps
+
+import click
+from pydantic import ValidationError
+
+from assertis.models import DiffOptions, PathFilter
+
+
+def parse_threshold(ctx, param, value):
+    "Parse a threshold into an integer, or a tuple of per-channel integers."
+    try:
+        thresholds = tuple(map(int, value.split(",")))
+    except ValueError:
+        raise click.BadParameter("expected N or R,G,B[,A], like 8 or 8,4,4")
+    return thresholds[0] if len(thresholds) == 1 else thresholds
+
+
+DIFF_OPTIONS = [
+    click.option(
+        "--tile-size",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Diff in square tiles of N pixels to bound temporary images (default is 0).",
+    ),
+    click.option(
+        "--metric",
+        type=click.Choice(["gray", "channel", "yiq"]),
+        default="gray",
+        help="Per-pixel difference metric: grayscale, per-channel or perceptual YIQ.",
+    ),
+    click.option(
+        "--threshold",
+        default="0",
+        callback=parse_threshold,
+        help="Largest per-pixel difference (0-255) still counted as unchanged, "
+        "or R,G,B[,A] for one per channel with --metric channel.",
+    ),
+    click.option(
+        "--ignore-antialiasing",
+        is_flag=True,
+        help="Ignore changed pixels explained by their neighbors, like anti-aliasing.",
+    ),
+    click.option(
+        "--compress-level",
+        type=click.IntRange(0, 9),
+        default=1,
+        help="zlib compression level (0-9) of the diff images (default is 1).",
+    ),
+]
+
+FILTER_OPTIONS = [
+    click.option(
+        "--include",
+        multiple=True,
+        help="Only process files matching this glob pattern (repeatable).",
+    ),
+    click.option(
+        "--exclude",
+        multiple=True,
+        help="Skip files and directories matching this glob pattern (repeatable).",
+    ),
+]
+
+
+def add_options(function, options):
+    # Applied in reverse so that --help lists them in order
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def with_diff_options(function):
+    "Add the diff options to a command, passed to it as one diff_options argument."
+
+    @wraps(function)
+    def wrapper(
+        *args,
+        tile_size,
+        metric,
+        threshold,
+        ignore_antialiasing,
+        compress_level,
+        **kwargs
+    ):
+        try:
+            options = DiffOptions(
+                metric=metric,
+                threshold=threshold,
+                ignore_antialiasing=ignore_antialiasing,
+                tile_size=tile_size,
+                compress_level=compress_level,
+            )
+        except ValidationError as e:
+            error = e.errors()[0]
+            raise click.UsageError(str(error.get("ctx", {}).get("error", error["msg"])))
+        return function(*args, diff_options=options, **kwargs)
+
+    return add_options(wrapper, DIFF_OPTIONS)
+
+
+def with_filter_options(function):
+    "Add --include and --exclude to a command, passed to it as one path_filter."
+
+    @wraps(function)
+    def wrapper(*args, include, exclude, **kwargs):
+        path_filter = PathFilter(include=include, exclude=exclude)
+        return function(*args, path_filter=path_filter, **kwargs)
+
+    return add_options(wrapper, FILTER_OPTIONS)
@@ -1,21 +1,113 @@
 import json
+import math
 import os
+import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import click
 from jinja2 import Environment, PackageLoader
+from PIL import Image, features
 
+from assertis.file_utils import copy_file
+from assertis.models import summarize_report, timed
 
-def generate_html_report(report_dir, report):
+# Outputs are named after the MD5 of their content
+CONTENT_ADDRESSED_NAME = re.compile(r"[0-9a-f]{32}\.\w+")
+
+PAGES_DIR = "pages"
+
+THUMBNAILS_DIR = "thumbnails"
+THUMBNAIL_SIZE = (400, 400)
+THUMBNAIL_SUFFIX = ".webp" if features.check("webp") else ".png"
+
+
+def thumbnail_name(filename):
+    "Return the path of the thumbnail of a report file, relative to the report."
+    return f"{THUMBNAILS_DIR}/{Path(filename).stem}{THUMBNAIL_SUFFIX}"
+
+
+def write_thumbnail(report_dir, filename):
+    "Write a downscaled copy of a report file unless it already exists."
+    target = report_dir / thumbnail_name(filename)
+    if target.exists():
+        return
+    try:
+        with Image.open(report_dir / filename) as image:
+            # Palettized diffs are converted first so that thin changes are
+            # blended into the thumbnail instead of dropped by nearest sampling
+            if image.mode == "P":
+                image = image.convert("RGBA")
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            temp = target.with_name(f".{target.name}.tmp")
+            image.save(temp, format=THUMBNAIL_SUFFIX[1:].upper())
+            os.replace(temp, target)
+    except OSError:
+        # The report falls back to the full-size image
+        pass
+
+
+def write_thumbnails(report, report_dir):
+    "Write thumbnails for all report files in parallel and remove stale ones."
+    thumbnails_dir = report_dir / THUMBNAILS_DIR
+    thumbnails_dir.mkdir(exist_ok=True)
+    # Changes-only reports reference unchanged files that were never copied
+    filenames = {
+        filename
+        for filename in referenced_files(report)
+        if (report_dir / filename).exists()
+    }
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(partial(write_thumbnail, report_dir), sorted(filenames)))
+
+    stems = {Path(filename).stem for filename in filenames}
+    for entry in os.scandir(thumbnails_dir):
+        if Path(entry.name).stem not in stems:
+            os.unlink(entry.path)
+
+
+def write_pages(report_dir, report, page_size):
+    "Split the file entries into JSON pages per status and return the page counts."
+    pages_dir = report_dir / PAGES_DIR
+    shutil.rmtree(pages_dir, ignore_errors=True)
+    pages_dir.mkdir()
+
+    pages = {}
+    for status in report.summary:
+        files = [file.model_dump() for file in report.files if file.type == status]
+        pages[status] = math.ceil(len(files) / page_size)
+        for index in range(pages[status]):
+            page = files[index * page_size : (index + 1) * page_size]
+            with open(pages_dir / f"{status}-{index}.json", "w") as page_file:
+                json.dump(page, page_file)
+    return pages
+
+
+def generate_html_report(report_dir, report, page_size=0):
     "Generate an HTML report from the comparison results."
     env = Environment(loader=PackageLoader("assertis", "templates"))
-    template = env.get_template("report_template.html")
+    env.filters["thumbnail"] = thumbnail_name
 
-    context = {
-        **report.model_dump(),
-        "files_json": json.dumps([file.model_dump() for file in report.files])
-    }
+    if page_size:
+        # Rows are loaded by the browser from JSON pages as the user scrolls
+        template = env.get_template("report_paged_template.html")
+        context = {
+            **report.model_dump(exclude={"outputs", "files"}),
+            "pages_json": json.dumps(write_pages(report_dir, report, page_size)),
+            "thumbnail_suffix": THUMBNAIL_SUFFIX,
+        }
+    else:
+        shutil.rmtree(report_dir / PAGES_DIR, ignore_errors=True)
+        template = env.get_template("report_template.html")
+        context = {
+            **report.model_dump(),
+            "files_json": json.dumps([file.model_dump() for file in report.files])
+        }
 
     html_content = template.render(context)
 
@@ -23,36 +115,89 @@ def generate_html_report(report_dir, report):
         report_file.write(html_content)
 
 
-def write_report(report, report_dir):
-    "Write the report to the report directory."
-    for output in report.outputs:
-        if isinstance(output.content, Path):
-            shutil.copy(output.content, report_dir / output.filename)
-        else:
-            output.content.save(report_dir / output.filename, format="PNG")
-
-    # Initialize summary with all possible keys
-    report.summary = {
-        "added": 0,
-        "changed": 0,
-        "unchanged": 0,
-        "deleted": 0,
+def referenced_files(report):
+    "Return the names of all report directory files referenced by the report."
+    return {
+        filename
+        for file in report.files
+        for filename in [
+            getattr(file, "actual_file", None),
+            getattr(file, "expected_file", None),
+            getattr(file, "diff_file", None),
+        ]
+        if filename
     }
 
-    for file in report.files:
-        report.summary[file.type] += 1
 
-    report.has_changes = bool(
-        report.summary["added"]
-        or report.summary["changed"]
-        or report.summary["deleted"]
-    )
+def write_output(output, report_dir):
+    "Write an output unless it already exists, returning (written, size)."
+    target = report_dir / output.filename
+    if target.exists():
+        return False, target.stat().st_size
+
+    # Write to a temporary name first so a partial file is never mistaken
+    # for a complete one on the next run
+    temp = report_dir / f".{output.filename}.tmp"
+    if isinstance(output.content, Path):
+        copy_file(output.content, temp)
+    else:
+        temp.write_bytes(output.content.data)
+    os.replace(temp, target)
+    return True, target.stat().st_size
+
+
+def record_output(report, output, report_dir):
+    "Write an output and count it in the report's output stats."
+    written, size = write_output(output, report_dir)
+    key = "written" if written else "skipped"
+    report.output_stats[key] += 1
+    report.output_stats[f"{key}_bytes"] += size
+
+
+def remove_orphans(report, report_dir):
+    "Delete content-addressed files that the report no longer references."
+    referenced = referenced_files(report)
+    for entry in os.scandir(report_dir):
+        if (
+            entry.is_file()
+            and CONTENT_ADDRESSED_NAME.fullmatch(entry.name)
+            and entry.name not in referenced
+        ):
+            os.unlink(entry.path)
+
+
+def write_files_ndjson(report, report_dir):
+    "Write the report's file entries to its NDJSON file, one per line."
+    temp = report_dir / f".{report.files_file}.tmp"
+    with open(temp, "w") as f:
+        for file in report.files:
+            f.write(file.model_dump_json() + "\n")
+    os.replace(temp, report_dir / report.files_file)
+
+
+def write_report(report, report_dir, page_size=0):
+    "Write the report to the report directory."
+    report_dir = Path(report_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    with timed(report.profile, "write_outputs"):
+        for output in report.outputs:
+            record_output(report, output, report_dir)
+        remove_orphans(report, report_dir)
+    with timed(report.profile, "thumbnails"):
+        write_thumbnails(report, report_dir)
 
-    generate_html_report(report_dir, report)
+    summarize_report(report)
+    with timed(report.profile, "html"):
+        generate_html_report(report_dir, report, page_size)
 
+    # File entries written to NDJSON are not repeated in report.json
+    exclude = {"outputs"}
+    if report.files_file:
+        write_files_ndjson(report, report_dir)
+        exclude.add("files")
     with open(report_dir / "report.json", "w") as json_file:
         json.dump(
-            report.model_dump(exclude={"outputs"}),
+            report.model_dump(exclude=exclude),
             json_file,
             indent=4,
         )
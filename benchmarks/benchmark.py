@@ -0,0 +1,275 @@
+"""Benchmark assertis over synthetic, procedurally generated image corpora.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.benchmark --count 10 --count 10000 --size 64 --size 2048
+
+Each stage runs in a fresh process so that its peak RSS is its own.
+"""
+
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import click
+from PIL import Image, ImageDraw, ImageOps
+
+from assertis.cmd_fix import apply_changes
+from assertis.cmd_verify import verify_report
+from assertis.comparison import run_comparison
+from assertis.md5_utils import Digests
+from assertis.models import iter_report_files, load_report
+from assertis.write import write_report
+
+
+def draw_image(rng, size):
+    "Draw a deterministic image: a colored gradient with random shapes."
+    gradient = Image.linear_gradient("L").rotate(rng.choice([0, 90, 180, 270]))
+    image = ImageOps.colorize(
+        gradient.resize((size, size)), random_color(rng), random_color(rng)
+    )
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = rng.randrange(size), rng.randrange(size)
+        radius = rng.randrange(1, size // 4 + 2)
+        shape = rng.choice([draw.ellipse, draw.rectangle])
+        shape((x - radius, y - radius, x + radius, y + radius), fill=random_color(rng))
+    return image
+
+
+def random_color(rng):
+    return tuple(rng.randrange(256) for _ in range(3))
+
+
+def generate_corpus(corpus_dir, count, size, added, changed, seed):
+    "Generate expected and actual directories with the given mix of files."
+    rng = random.Random(f"{seed}-{count}-{size}")
+    for index in range(count):
+        # Spread files over subdirectories like a real screenshot tree
+        name = Path(f"{index // 1000:03d}") / f"img_{index:06d}.png"
+        expected_path = corpus_dir / "expected" / name
+        actual_path = corpus_dir / "actual" / name
+        expected_path.parent.mkdir(parents=True, exist_ok=True)
+        actual_path.parent.mkdir(parents=True, exist_ok=True)
+
+        kind = rng.random()
+        image = draw_image(random.Random(f"{seed}-{index}"), size)
+        if kind < added:
+            image.save(actual_path)
+            continue
+
+        image.save(expected_path)
+        if kind < added + changed:
+            # Mark a small square so only part of the image changes
+            mark = max(size // 16, 1)
+            ImageDraw.Draw(image).rectangle((0, 0, mark, mark), fill=(255, 0, 255))
+            image.save(actual_path)
+        else:
+            shutil.copyfile(expected_path, actual_path)
+
+
+def corpus_bytes(corpus_dir):
+    "Total size of the input images of a corpus."
+    return sum(path.stat().st_size for path in corpus_dir.rglob("*.png"))
+
+
+def peak_rss():
+    "Peak RSS in bytes of this process plus its largest finished child."
+    usage = [
+        resource.getrusage(who).ru_maxrss
+        for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]
+    ]
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return sum(usage) * scale
+
+
+def compare_stage(corpus_dir, state_file, report_dir, jobs):
+    # Outputs stream to the report directory while comparing, as in the CLI
+    start = time.perf_counter()
+    report = run_comparison(
+        corpus_dir / "expected",
+        corpus_dir / "actual",
+        0,
+        jobs,
+        cache=False,
+        report_dir=report_dir,
+    )
+    seconds, rss = time.perf_counter() - start, peak_rss()
+    with open(state_file, "wb") as f:
+        pickle.dump(report, f)
+    return seconds, rss
+
+
+def write_stage(state_file, report_dir):
+    with open(state_file, "rb") as f:
+        report = pickle.load(f)
+    start = time.perf_counter()
+    write_report(report, report_dir)
+    return time.perf_counter() - start, peak_rss()
+
+
+def verify_stage(report_dir, expected_dir):
+    start = time.perf_counter()
+    errors = verify_report(
+        iter_report_files(report_dir),
+        report_dir,
+        expected_dir,
+        Digests(),
+        load_report(report_dir).changes_only,
+    )
+    if errors:
+        raise RuntimeError(f"Report failed verification: {errors[:5]}")
+    return time.perf_counter() - start, peak_rss()
+
+
+def fix_stage(report_dir, expected_dir):
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        apply_changes(iter_report_files(report_dir), report_dir, expected_dir, False)
+    return time.perf_counter() - start, peak_rss()
+
+
+def stage_main(connection, function, args):
+    connection.send(function(*args))
+
+
+def run_stage(function, *args):
+    "Run a stage in a fresh process and return its seconds and peak RSS."
+    # Not a Pool: its daemonic workers could not start comparison workers
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=stage_main, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"{function.__name__} failed") from None
+    finally:
+        process.join()
+
+
+def run_benchmark(work_dir, count, size, added, changed, jobs, seed):
+    "Generate or reuse a corpus and measure every stage on it."
+    corpus_dir = work_dir / f"corpus-{count}-{size}-{added}-{changed}-{seed}"
+    if not (corpus_dir / ".complete").exists():
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        generate_corpus(corpus_dir, count, size, added, changed, seed)
+        (corpus_dir / ".complete").touch()
+
+    run_dir = work_dir / "run"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    report_dir = run_dir / "report"
+    report_dir.mkdir(parents=True)
+    # Fix rewrites the expected directory, so it works on a copy
+    expected_copy = run_dir / "expected"
+    shutil.copytree(corpus_dir / "expected", expected_copy)
+    state_file = run_dir / "report.pickle"
+
+    timings = {
+        "compare": run_stage(compare_stage, corpus_dir, state_file, report_dir, jobs),
+        "write": run_stage(write_stage, state_file, report_dir),
+        "verify": run_stage(verify_stage, report_dir, expected_copy),
+        "fix": run_stage(fix_stage, report_dir, expected_copy),
+    }
+    total_bytes = corpus_bytes(corpus_dir)
+    shutil.rmtree(run_dir)
+
+    return [
+        {
+            "count": count,
+            "size": size,
+            "stage": stage,
+            "seconds": seconds,
+            "files_per_second": count / seconds if seconds else None,
+            "megabytes_per_second": total_bytes / 1e6 / seconds if seconds else None,
+            "peak_rss_bytes": rss,
+        }
+        for stage, (seconds, rss) in timings.items()
+    ]
+
+
+@click.command()
+@click.option(
+    "--count",
+    multiple=True,
+    type=int,
+    default=[10, 1000],
+    help="Number of images per corpus, repeatable (default is 10 and 1000).",
+)
+@click.option(
+    "--size",
+    multiple=True,
+    type=int,
+    default=[64, 1024],
+    help="Width and height of the images, repeatable (default is 64 and 1024).",
+)
+@click.option(
+    "--added",
+    default=0.1,
+    help="Fraction of images that are only in the actual directory (default is 0.1).",
+)
+@click.option(
+    "--changed",
+    default=0.1,
+    help="Fraction of images that differ between directories (default is 0.1).",
+)
+@click.option(
+    "--jobs",
+    default=1,
+    help="Number of worker processes used to compare files (default is 1).",
+)
+@click.option("--seed", default=0, help="Seed of the generated corpora (default is 0).")
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Keep generated corpora here to reuse them (default is a temp directory).",
+)
+@click.option(
+    "--json",
+    "json_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also write the results to this JSON file.",
+)
+def benchmark(count, size, added, changed, jobs, seed, work_dir, json_path):
+    "Measure throughput and peak RSS of each stage over synthetic corpora."
+    with tempfile.TemporaryDirectory(prefix="assertis_bench_") as temp_dir:
+        work_dir = work_dir or Path(temp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        results = []
+        click.echo(
+            f"{'count':>8} {'size':>6} {'stage':<8} {'seconds':>9} "
+            f"{'files/s':>10} {'MB/s':>8} {'peak RSS MB':>12}"
+        )
+        for image_count in count:
+            for image_size in size:
+                for result in run_benchmark(
+                    work_dir, image_count, image_size, added, changed, jobs, seed
+                ):
+                    results.append(result)
+                    click.echo(
+                        f"{result['count']:>8} {result['size']:>6} "
+                        f"{result['stage']:<8} {result['seconds']:>9.3f} "
+                        f"{result['files_per_second'] or 0:>10.1f} "
+                        f"{result['megabytes_per_second'] or 0:>8.1f} "
+                        f"{result['peak_rss_bytes'] / 1e6:>12.1f}"
+                    )
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -6,7 +6,7 @@ setup(
     packages=find_packages(exclude=["tests"]),
     install_requires=[
         "click",
-        "Pillow",
+        "Pillow>=10.3",
         "pydantic",
         "jinja2",
         "watchdog",
@@ -26,5 +26,5 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.10",
 )
@@ -2,3 +2,11 @@ import os
 import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    "Keep the digest cache of each test out of the user's home directory."
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
@@ -1,19 +1,23 @@
+import asyncio
 import json
+import shutil
 import tempfile
 from pathlib import Path
 
 import pytest
 from click.testing import CliRunner
 
+from assertis import ComparisonException, DiffOptions, cmd_fix, compare, compare_async
 from assertis.cli import assertis  # Replace with the actual name of your script module
-from assertis.models import Report
+from assertis.models import Report, iter_report_files, load_report
 
 
-def generate_report(cases_dir):
+def generate_report(cases_dir, *args):
     cases_path = Path(cases_dir)
-    expected_dir = cases_path / "expected"
-    actual_dir = cases_path / "actual"
+    return generate_report_dirs(cases_path / "expected", cases_path / "actual", *args)
 
+
+def generate_report_dirs(expected_dir, actual_dir, *args):
     with tempfile.TemporaryDirectory() as temp_dir:
         report_dir = Path(temp_dir)
 
@@ -27,6 +31,7 @@ def generate_report(cases_dir):
                 str(report_dir),
                 "--sensitivity",
                 "0",
+                *args,
             ],
             catch_exceptions=False,  # Ensure that exceptions are not caught and displayed in stderr
         )
@@ -95,3 +100,376 @@ def test_unchanged():
     assert exit_code == 0
     assert report.has_changes is False
     assert {k: v for k, v in report.summary.items() if v != 0} == {"unchanged": 1}
+
+
+def test_parallel_matches_serial():
+    _, serial = generate_report(Path("testcases/lots_of_files"))
+    _, parallel = generate_report(Path("testcases/lots_of_files"), "--jobs", "4")
+    assert parallel.model_dump() == serial.model_dump()
+
+
+def test_ndjson_fix_and_verify(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected = tmp_path / "expected"
+    shutil.copytree(cases / "expected", expected)
+    report_dir = tmp_path / "report"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        assertis,
+        [
+            "compare",
+            str(expected),
+            str(cases / "actual"),
+            str(report_dir),
+            "--format",
+            "ndjson",
+        ],
+    )
+    assert result.exit_code == 1
+    with open(report_dir / "report.json") as f:
+        report = json.load(f)
+    assert "files" not in report
+    assert report["summary"]["changed"] == 5
+    lines = (report_dir / report["files_file"]).read_text().splitlines()
+    assert len(lines) == 10
+    entries = [json.loads(line) for line in lines]
+    order = ["changed", "added", "deleted", "unchanged"]
+    assert entries == sorted(entries, key=lambda e: (order.index(e["type"]), e["name"]))
+
+    result = runner.invoke(assertis, ["verify", str(expected), str(report_dir)])
+    assert result.exit_code == 0
+    result = runner.invoke(assertis, ["fix", str(expected), str(report_dir)])
+    assert result.exit_code == 0
+
+    _, report = generate_report_dirs(expected, cases / "actual")
+    assert report.has_changes is False
+
+
+def test_fail_fast_stops_at_first_difference():
+    exit_code, report = generate_report(Path("testcases/lots_of_files"), "--fail-fast")
+    assert exit_code == 1
+    assert report.partial is True
+    assert [file.name for file in report.files] == ["img_10.jpg"]
+
+
+def test_fail_fast_skips_unchanged_outputs(tmp_path):
+    cases = Path("testcases/files_unchanged")
+    runner = CliRunner()
+    result = runner.invoke(
+        assertis,
+        [
+            "compare",
+            str(cases / "expected"),
+            str(cases / "actual"),
+            str(tmp_path / "report"),
+            "--fail-fast",
+        ],
+    )
+    assert result.exit_code == 0
+    assert sorted(path.name for path in (tmp_path / "report").iterdir()) == [
+        "index.html",
+        "report.json",
+        "thumbnails",
+    ]
+
+
+def test_fix_refuses_partial_report(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    runner = CliRunner()
+    args = [str(cases / "expected"), str(cases / "actual"), str(tmp_path)]
+    runner.invoke(assertis, ["compare", *args, "--fail-fast"])
+
+    result = runner.invoke(assertis, ["fix", str(cases / "expected"), str(tmp_path)])
+    assert result.exit_code == 1
+    assert "Report is partial" in result.output
+
+
+def test_changes_only_report(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected = tmp_path / "expected"
+    shutil.copytree(cases / "expected", expected)
+    report_dir = tmp_path / "report"
+
+    runner = CliRunner()
+    args = [str(expected), str(cases / "actual"), str(report_dir)]
+    result = runner.invoke(assertis, ["compare", *args, "--changes-only"])
+    assert result.exit_code == 1
+
+    with open(report_dir / "report.json") as f:
+        report = Report(**json.load(f))
+    assert report.changes_only is True
+    assert report.summary["unchanged"] == 5
+    for file in report.files:
+        copied = (report_dir / file.actual_file).exists()
+        assert copied == (file.type != "unchanged")
+    assert "Unchanged image not copied" in (report_dir / "index.html").read_text()
+
+    result = runner.invoke(assertis, ["verify", str(expected), str(report_dir)])
+    assert result.exit_code == 0
+    result = runner.invoke(assertis, ["fix", str(expected), str(report_dir)])
+    assert result.exit_code == 0
+
+
+def test_compare_async_streams_entries(tmp_path):
+    async def collect():
+        names = []
+        with pytest.raises(ComparisonException):
+            async for file in compare_async(
+                "testcases/lots_of_files/expected",
+                "testcases/lots_of_files/actual",
+                tmp_path / "report",
+                jobs=2,
+            ):
+                names.append(file.name)
+        return names
+
+    names = asyncio.run(collect())
+    report = load_report(tmp_path / "report")
+    assert sorted(names) == sorted(file.name for file in report.files)
+    assert report.has_changes
+
+
+def test_compare_async_can_be_cancelled(tmp_path):
+    async def first():
+        comparison = compare_async(
+            "testcases/lots_of_files/expected",
+            "testcases/lots_of_files/actual",
+            tmp_path,
+        )
+        file = await anext(comparison)
+        await comparison.aclose()
+        return file
+
+    assert asyncio.run(first()).name.startswith("img_")
+    assert not (tmp_path / "report.json").exists()
+
+
+def test_profile_records_timings(tmp_path):
+    result = CliRunner().invoke(
+        assertis,
+        [
+            "compare",
+            "testcases/lots_of_files/expected",
+            "testcases/lots_of_files/actual",
+            str(tmp_path),
+            "--profile",
+        ],
+    )
+    assert result.exit_code == 1
+    assert "Slowest pairs:" in result.output
+
+    report = load_report(tmp_path)
+    assert {"glob", "compare", "write_outputs", "html"} <= report.profile.stages.keys()
+    assert sorted(f.name for f in report.profile.files) == sorted(
+        f.name for f in report.files
+    )
+    changed = [f.name for f in report.files if f.type == "changed" and f.diff_file]
+    timings = {f.name: f for f in report.profile.files}
+    assert all(timings[name].decode_seconds > 0 for name in changed)
+    assert all(timings[name].bytes_read > 0 for name in changed)
+    # Outputs are streamed while comparing but timed as writing them
+    assert all(timings[name].write_seconds > 0 for name in changed)
+    assert report.profile.stages["write_outputs"] >= sum(
+        f.write_seconds for f in report.profile.files
+    )
+
+
+def test_include_and_exclude_patterns():
+    exit_code, report = generate_report(
+        Path("testcases/lots_of_files"), "--include", "img_1*", "--exclude", "img_1.*"
+    )
+    assert [file.name for file in report.files] == ["img_10.jpg"]
+
+
+def test_sharded_reports_merge_fix_and_verify(tmp_path):
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    shutil.copytree("testcases/lots_of_files/expected", expected)
+    shutil.copytree("testcases/lots_of_files/actual", actual)
+    (actual / "img_5.jpg").unlink()
+    shutil.copy(actual / "img_2.jpg", actual / "img_11.jpg")
+
+    runner = CliRunner()
+    shard_dirs = []
+    for index in range(1, 4):
+        shard_dir = tmp_path / f"shard_{index}"
+        runner.invoke(
+            assertis,
+            ["compare", str(expected), str(actual), str(shard_dir)]
+            + ["--shard", f"{index}/3"],
+        )
+        shard_dirs.append(str(shard_dir))
+    merged = tmp_path / "merged"
+    result = runner.invoke(assertis, ["merge", str(merged), *shard_dirs])
+    assert result.exit_code == 1
+
+    full = tmp_path / "full"
+    runner.invoke(assertis, ["compare", str(expected), str(actual), str(full)])
+    assert load_report(merged).files == load_report(full).files
+    assert sum(len(load_report(d).files) for d in shard_dirs) == 11
+    assert {p.name for p in merged.glob("*.*")} == {p.name for p in full.glob("*.*")}
+
+    result = runner.invoke(assertis, ["verify", str(expected), str(merged)])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(assertis, ["fix", str(expected), str(merged)])
+    assert result.exit_code == 0, result.output
+    assert (
+        "Comparison passed."
+        in runner.invoke(
+            assertis, ["compare", str(expected), str(actual), str(tmp_path / "after")]
+        ).output
+    )
+
+
+def test_merge_rejects_overlapping_reports(tmp_path):
+    runner = CliRunner()
+    cases = "testcases/lots_of_files"
+    runner.invoke(
+        assertis,
+        ["compare", f"{cases}/expected", f"{cases}/actual", str(tmp_path / "a")],
+    )
+    result = runner.invoke(
+        assertis,
+        ["merge", str(tmp_path / "merged"), str(tmp_path / "a"), str(tmp_path / "a")],
+    )
+    assert result.exit_code == 1
+    assert "more than one report" in result.output
+    assert not (tmp_path / "merged").exists()
+
+
+def test_merge_rejects_mismatched_shards_before_copying(tmp_path):
+    runner = CliRunner()
+    cases = "testcases/lots_of_files"
+    for name, shard in [("a", "1/2"), ("b", "2/3")]:
+        runner.invoke(
+            assertis,
+            ["compare", f"{cases}/expected", f"{cases}/actual", str(tmp_path / name)]
+            + ["--shard", shard],
+        )
+    merged = tmp_path / "merged"
+    merged.mkdir()
+    result = runner.invoke(
+        assertis, ["merge", str(merged), str(tmp_path / "a"), str(tmp_path / "b")]
+    )
+    assert result.exit_code == 1
+    assert "different counts" in result.output
+    assert not merged.exists()
+
+
+def interrupted_fix(tmp_path, monkeypatch):
+    "Copy lots_of_files, write a report and fail the fix after two operations."
+    cases = Path("testcases/lots_of_files")
+    expected = tmp_path / "expected"
+    shutil.copytree(cases / "expected", expected)
+    report_dir = tmp_path / "report"
+    runner = CliRunner()
+    runner.invoke(
+        assertis, ["compare", str(expected), str(cases / "actual"), str(report_dir)]
+    )
+
+    apply_operation = cmd_fix.apply_operation
+    applied = []
+
+    def failing_apply_operation(*args):
+        if len(applied) == 2:
+            raise OSError("No space left on device")
+        apply_operation(*args)
+        applied.append(args[-1])
+
+    monkeypatch.setattr(cmd_fix, "apply_operation", failing_apply_operation)
+    result = runner.invoke(
+        assertis, ["fix", str(expected), str(report_dir), "--jobs", "1"]
+    )
+    monkeypatch.setattr(cmd_fix, "apply_operation", apply_operation)
+    assert result.exit_code == 1
+    assert "--resume or --rollback" in result.output
+    assert cmd_fix.journal_dir(expected).exists()
+    return runner, expected, cases / "actual"
+
+
+def test_fix_rolls_back_interrupted_fix(tmp_path, monkeypatch):
+    runner, expected, _ = interrupted_fix(tmp_path, monkeypatch)
+    original = Path("testcases/lots_of_files/expected")
+
+    result = runner.invoke(assertis, ["fix", str(expected), str(tmp_path / "report")])
+    assert result.exit_code == 1
+    result = runner.invoke(assertis, ["fix", str(expected), "--rollback"])
+    assert result.exit_code == 0, result.output
+    assert not cmd_fix.journal_dir(expected).exists()
+    assert sorted(p.name for p in expected.iterdir()) == sorted(
+        p.name for p in original.iterdir()
+    )
+    for path in original.iterdir():
+        assert (expected / path.name).read_bytes() == path.read_bytes()
+
+
+def test_compare_ignores_interrupted_fix(tmp_path, monkeypatch):
+    runner, expected, actual = interrupted_fix(tmp_path, monkeypatch)
+    _, report = generate_report_dirs(expected, actual)
+    assert report.files
+    assert not [f.name for f in report.files if cmd_fix.JOURNAL_SUFFIX in f.name]
+    result = runner.invoke(
+        assertis, ["verify", str(expected), str(tmp_path / "report")]
+    )
+    assert cmd_fix.JOURNAL_SUFFIX not in result.output
+
+
+def test_fix_resumes_interrupted_fix(tmp_path, monkeypatch):
+    runner, expected, actual = interrupted_fix(tmp_path, monkeypatch)
+
+    result = runner.invoke(assertis, ["fix", str(expected), "--resume", "--hardlink"])
+    assert result.exit_code == 0, result.output
+    assert "Resumed and applied" in result.output
+    assert not cmd_fix.journal_dir(expected).exists()
+    _, report = generate_report_dirs(expected, actual)
+    assert report.has_changes is False
+
+
+def test_fix_summarizes_changes(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected = tmp_path / "expected"
+    shutil.copytree(cases / "expected", expected)
+    report_dir = tmp_path / "report"
+    runner = CliRunner()
+    runner.invoke(
+        assertis, ["compare", str(expected), str(cases / "actual"), str(report_dir)]
+    )
+
+    result = runner.invoke(assertis, ["fix", str(expected), str(report_dir)])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip().splitlines()[-1].startswith("Copied ")
+    assert "unchanged." in result.output
+    assert "Copied file" not in result.output
+
+
+def test_compare_takes_diff_options(tmp_path):
+    cases = Path("testcases/files_changed")
+    with pytest.raises(ComparisonException):
+        compare(cases / "expected", cases / "actual", tmp_path / "strict")
+    compare(
+        cases / "expected",
+        cases / "actual",
+        tmp_path / "tolerant",
+        diff_options=DiffOptions(threshold=255),
+    )
+
+
+def test_fix_without_workers_leaves_no_journal(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected = tmp_path / "expected"
+    shutil.copytree(cases / "expected", expected)
+    report_dir = tmp_path / "report"
+    runner = CliRunner()
+    runner.invoke(
+        assertis, ["compare", str(expected), str(cases / "actual"), str(report_dir)]
+    )
+
+    result = runner.invoke(
+        assertis, ["fix", str(expected), str(report_dir), "--jobs", "0"]
+    )
+    assert result.exit_code == 2
+    with pytest.raises(ValueError):
+        cmd_fix.apply_changes(
+            iter_report_files(report_dir), report_dir, expected, False, jobs=0
+        )
+    assert not cmd_fix.journal_dir(expected).exists()
@@ -0,0 +1,33 @@
+import json
+
+from click.testing import CliRunner
+
+from benchmarks.benchmark import benchmark, generate_corpus
+
+
+def test_corpus_is_deterministic(tmp_path):
+    generate_corpus(tmp_path / "a", 20, 16, 0.2, 0.3, seed=1)
+    generate_corpus(tmp_path / "b", 20, 16, 0.2, 0.3, seed=1)
+    files_a = sorted(
+        p.relative_to(tmp_path / "a") for p in (tmp_path / "a").rglob("*.png")
+    )
+    files_b = sorted(
+        p.relative_to(tmp_path / "b") for p in (tmp_path / "b").rglob("*.png")
+    )
+    assert files_a == files_b
+    assert all(
+        (tmp_path / "a" / path).read_bytes() == (tmp_path / "b" / path).read_bytes()
+        for path in files_a
+    )
+
+
+def test_benchmark_measures_every_stage(tmp_path):
+    result = CliRunner().invoke(
+        benchmark,
+        ["--count", "5", "--size", "16", "--json", str(tmp_path / "results.json")],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    results = json.loads((tmp_path / "results.json").read_text())
+    assert [r["stage"] for r in results] == ["compare", "write", "verify", "fix"]
+    assert all(r["peak_rss_bytes"] > 0 for r in results)
@@ -0,0 +1,97 @@
+import shutil
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from assertis.comparison import (
+    run_comparison,
+    run_memory_comparison,
+    update_comparison,
+)
+from assertis.write import write_report
+
+
+def test_update_matches_full_comparison(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    shutil.copytree(cases / "expected", expected)
+    shutil.copytree(cases / "actual", actual)
+    report = run_comparison(expected, actual, 0)
+
+    shutil.copy(expected / "img_2.jpg", actual / "img_2.jpg")
+    shutil.copy(actual / "img_4.jpg", actual / "img_3.jpg")
+    (actual / "img_5.jpg").unlink()
+    shutil.copy(actual / "img_1.jpg", actual / "img_11.jpg")
+    changed = ["img_2.jpg", "img_3.jpg", "img_5.jpg", "img_11.jpg", "notes.txt"]
+
+    update_comparison(report, expected, actual, 0, changed)
+    full = run_comparison(expected, actual, 0)
+
+    assert report.files == full.files
+    assert {output.filename for output in report.outputs} <= {
+        output.filename for output in full.outputs
+    }
+
+
+def test_memory_comparison_matches_directories(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected = {
+        str(path.relative_to(cases / "expected")): path.read_bytes()
+        for path in (cases / "expected").glob("*.jpg")
+    }
+    actual = {
+        str(path.relative_to(cases / "actual")): BytesIO(path.read_bytes())
+        for path in (cases / "actual").glob("*.jpg")
+    }
+    report = run_memory_comparison(expected, actual, 0)
+    assert not list(tmp_path.iterdir())
+
+    full = run_comparison(cases / "expected", cases / "actual", 0)
+    assert report.files == full.files
+    assert report.has_changes
+
+    report_dir = tmp_path / "report"
+    report_dir.mkdir()
+    write_report(report, report_dir)
+    assert {path.name for path in report_dir.glob("*.jpg")} == {
+        output.filename for output in full.outputs if output.filename.endswith(".jpg")
+    }
+
+
+def test_memory_comparison_of_pil_images():
+    image = Image.new("RGB", (10, 10), "white")
+    changed = image.copy()
+    changed.putpixel((5, 5), (0, 0, 0))
+
+    report = run_memory_comparison({"a": image}, {"a": image.copy()}, 0)
+    assert [file.type for file in report.files] == ["unchanged"]
+    assert report.files[0].actual_file.endswith(".png")
+
+    report = run_memory_comparison({"a": image}, {"a": changed}, 0)
+    assert [file.type for file in report.files] == ["changed"]
+    assert report.files[0].diff_file
+
+
+def test_write_report_creates_report_dir(tmp_path):
+    image = Image.new("RGB", (10, 10), "white")
+    report = run_memory_comparison({"a": image}, {}, 0)
+    write_report(report, tmp_path / "nested" / "report")
+    assert (tmp_path / "nested" / "report" / "report.json").exists()
+
+
+def test_outputs_stream_to_report_dir(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    report_dir = tmp_path / "report"
+    report_dir.mkdir()
+    report = run_comparison(
+        cases / "expected", cases / "actual", 0, report_dir=report_dir
+    )
+    full = run_comparison(cases / "expected", cases / "actual", 0)
+
+    assert report.outputs == []
+    assert report.files == full.files
+    assert {path.name for path in report_dir.iterdir()} == {
+        output.filename for output in full.outputs
+    }
+    assert report.output_stats["written"] == len(full.outputs)
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+from assertis.file_utils import glob, is_selected, supported_extensions
+from assertis.models import PathFilter
+
+
+def reference_glob(directory):
+    "The original Path.rglob implementation, kept to check parity."
+    return {
+        f.relative_to(directory)
+        for f in Path(directory).rglob("*")
+        if f.is_file() and f.suffix.lower() in supported_extensions
+    }
+
+
+def make_tree(root):
+    for name in [
+        "a.png",
+        "b.txt",
+        "icons/c.png",
+        "icons/small/d.PNG",
+        "node_modules/pkg/e.png",
+        "screens/ios/f.png",
+        "screens/android/g.png",
+    ]:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(b"")
+
+
+def test_glob_matches_rglob():
+    assert glob("testcases") == reference_glob("testcases")
+    assert glob("testcases", jobs=4) == reference_glob("testcases")
+
+
+def test_include_and_exclude(tmp_path):
+    make_tree(tmp_path)
+
+    def names(**patterns):
+        found = glob(tmp_path, PathFilter(**patterns), jobs=2)
+        # The walker and the per-path check agree
+        assert found == {
+            path
+            for path in reference_glob(tmp_path)
+            if is_selected(path, PathFilter(**patterns))
+        }
+        return sorted(path.as_posix() for path in found)
+
+    assert names(exclude=["node_modules"]) == [
+        "a.png",
+        "icons/c.png",
+        "icons/small/d.PNG",
+        "screens/android/g.png",
+        "screens/ios/f.png",
+    ]
+    assert names(include=["icons"]) == ["icons/c.png", "icons/small/d.PNG"]
+    assert names(include=["screens/*/f.png", "a.*"]) == ["a.png", "screens/ios/f.png"]
+    assert names(include=["icons"], exclude=["small"]) == ["icons/c.png"]
@@ -0,0 +1,208 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageChops
+
+from assertis.image_comparison import compare_images, encode_diff
+from assertis.models import DiffOptions
+
+CASES = [
+    Path("testcases/files_changed"),
+    Path("testcases/files_changed_lot"),
+    Path("testcases/files_unchanged"),
+] + [Path("testcases/lots_of_files") / f"img_{i}.jpg" for i in range(1, 11)]
+
+
+def pair(case):
+    "Return the (expected, actual) paths for a test case directory or file."
+    if case.suffix:
+        return case.parent / "expected" / case.name, case.parent / "actual" / case.name
+    return case / "expected" / "img1.jpg", case / "actual" / "img1.jpg"
+
+
+def reference_compare_images(img1_path, img2_path, sensitivity):
+    "The original per-pixel implementation, kept to check parity."
+    img1 = Image.open(img1_path)
+    img2 = Image.open(img2_path)
+    diff = ImageChops.difference(img1, img2)
+    diff_mask = diff.convert("L")
+    diff_highlight = Image.new("RGBA", img1.size, (0, 0, 0, 0))
+    for x in range(diff.width):
+        for y in range(diff.height):
+            if diff_mask.getpixel((x, y)) > 0:
+                diff_highlight.putpixel((x, y), (255, 0, 0, 255))
+    total_pixels = img1.size[0] * img1.size[1]
+    changed_pixels = sum(
+        1
+        for y in range(diff.height)
+        for x in range(diff.width)
+        if diff_mask.getpixel((x, y)) > 0
+    )
+    change_extent = (changed_pixels / total_pixels) * 100
+    reasons = [f"Pixels changed with extent {change_extent:.2f}%"]
+    return change_extent <= sensitivity, diff_highlight, reasons
+
+
+@pytest.mark.parametrize("case", CASES, ids=str)
+@pytest.mark.parametrize("sensitivity", [0, 50])
+def test_parity(case, sensitivity):
+    expected_path, actual_path = pair(case)
+    identical, diff_image, reasons = compare_images(
+        expected_path, actual_path, sensitivity
+    )
+    ref_identical, ref_diff_image, ref_reasons = reference_compare_images(
+        expected_path, actual_path, sensitivity
+    )
+    assert identical == ref_identical
+    if ref_diff_image.getbbox() is None:
+        # Identical pixels take the fast path and skip the overlay
+        assert diff_image is None
+        assert reasons == ["Pixels unchanged"]
+    else:
+        assert reasons == ref_reasons
+        assert diff_image.mode == "P"
+        assert diff_image.convert("RGBA").tobytes() == ref_diff_image.tobytes()
+
+
+def test_metadata_changes_skip_diff():
+    identical, diff_image, reasons = compare_images(
+        "testcases/files_changed_size/expected/img1.jpg",
+        "testcases/files_changed_size/actual/img1.jpg",
+        100,
+    )
+    assert identical is False
+    assert diff_image is None
+    assert reasons == ["Size changed from (200, 300) to (250, 375)"]
+
+
+def test_reencoded_image_is_unchanged(tmp_path):
+    image = Image.open("testcases/files_changed_mode/actual/img1.png")
+    image.save(tmp_path / "fast.png", compress_level=1)
+    image.save(tmp_path / "small.png", compress_level=9, optimize=True)
+    assert (tmp_path / "fast.png").read_bytes() != (tmp_path / "small.png").read_bytes()
+
+    identical, diff_image, reasons = compare_images(
+        tmp_path / "fast.png", tmp_path / "small.png", 0
+    )
+    assert identical is True
+    assert diff_image is None
+    assert reasons == ["Pixels unchanged"]
+
+
+@pytest.mark.parametrize("case", CASES, ids=str)
+def test_tiled_matches_whole_image(case):
+    expected_path, actual_path = pair(case)
+    identical, diff_image, reasons = compare_images(expected_path, actual_path, 0)
+    tiled_identical, tiled_diff_image, tiled_reasons = compare_images(
+        expected_path, actual_path, 0, DiffOptions(tile_size=64)
+    )
+    assert tiled_identical == identical
+    assert tiled_reasons == reasons
+    if diff_image is None:
+        assert tiled_diff_image is None
+    else:
+        assert tiled_diff_image.tobytes() == diff_image.tobytes()
+
+
+def test_negative_tile_size_is_rejected():
+    with pytest.raises(ValueError):
+        DiffOptions(tile_size=-5)
+
+
+@pytest.mark.parametrize("compress_level", [-1, 12])
+def test_compress_level_out_of_range_is_rejected(compress_level):
+    with pytest.raises(ValueError):
+        DiffOptions(compress_level=compress_level)
+
+
+def save_pair(tmp_path, image1, image2):
+    image1.save(tmp_path / "expected.png")
+    image2.save(tmp_path / "actual.png")
+    return tmp_path / "expected.png", tmp_path / "actual.png"
+
+
+def test_threshold_ignores_small_deltas(tmp_path):
+    paths = save_pair(
+        tmp_path,
+        Image.new("RGB", (8, 8), (100,) * 3),
+        Image.new("RGB", (8, 8), (104,) * 3),
+    )
+    assert compare_images(*paths, 0)[0] is False
+    assert compare_images(*paths, 0, DiffOptions(threshold=4))[0] is True
+    assert compare_images(*paths, 0, DiffOptions(threshold=3))[0] is False
+
+
+def test_channel_metric_catches_single_channel_changes(tmp_path):
+    paths = save_pair(
+        tmp_path,
+        Image.new("RGB", (8, 8), (0, 0, 0)),
+        Image.new("RGB", (8, 8), (0, 0, 2)),
+    )
+    assert compare_images(*paths, 0)[0] is True
+    assert compare_images(*paths, 0, DiffOptions(metric="channel"))[0] is False
+    assert compare_images(*paths, 0, DiffOptions(metric="channel", threshold=2))[0]
+
+
+def test_channel_metric_takes_per_channel_thresholds(tmp_path):
+    paths = save_pair(
+        tmp_path,
+        Image.new("RGBA", (8, 8), (0, 0, 0, 255)),
+        Image.new("RGBA", (8, 8), (0, 0, 6, 255)),
+    )
+    loose_blue = DiffOptions(metric="channel", threshold=(0, 0, 6))
+    assert compare_images(*paths, 0, loose_blue)[0] is True
+    loose_red = DiffOptions(metric="channel", threshold=(6, 0, 0))
+    assert compare_images(*paths, 0, loose_red)[0] is False
+
+    with pytest.raises(ValueError):
+        DiffOptions(threshold=(6, 0, 0))
+
+
+@pytest.mark.parametrize("threshold", [-1, 256, (0, -1, 0), (0, 0, 0, 300)])
+def test_threshold_out_of_range_is_rejected(threshold):
+    with pytest.raises(ValueError):
+        DiffOptions(metric="channel", threshold=threshold)
+
+
+def test_yiq_metric_weights_perceptual_differences(tmp_path):
+    gray = Image.new("RGB", (8, 8), (128, 128, 128))
+    options = DiffOptions(metric="yiq", threshold=10)
+    blue = save_pair(tmp_path, gray, Image.new("RGB", (8, 8), (128, 128, 148)))
+    assert compare_images(*blue, 0, options)[0] is True
+    green = save_pair(tmp_path, gray, Image.new("RGB", (8, 8), (128, 148, 128)))
+    assert compare_images(*green, 0, options)[0] is False
+
+
+def edge_image(edge, square=False):
+    image = Image.new("RGB", (32, 32), "white")
+    image.paste((0, 0, 0), (edge, 0, 32, 32))
+    if square:
+        image.paste((255, 0, 0), (2, 2, 6, 6))
+    return image
+
+
+@pytest.mark.parametrize("tile_size", [0, 5])
+def test_ignore_antialiasing(tmp_path, tile_size):
+    options = DiffOptions(ignore_antialiasing=True, tile_size=tile_size)
+    shifted = save_pair(tmp_path, edge_image(16), edge_image(17))
+    assert compare_images(*shifted, 0)[0] is False
+    assert compare_images(*shifted, 0, options)[:2] == (True, None)
+
+    added = save_pair(tmp_path, edge_image(16), edge_image(17, square=True))
+    identical, _, reasons = compare_images(*added, 0, options)
+    assert identical is False
+    assert reasons == ["Pixels changed with extent 1.56%"]
+
+
+@pytest.mark.parametrize("case", CASES[:2])
+def test_encoded_diff_is_a_1bit_overlay(case):
+    _, diff_image, _ = compare_images(*pair(case), 0)
+    encoded = encode_diff(diff_image)
+
+    with Image.open(BytesIO(encoded)) as decoded:
+        assert decoded.mode == "P"
+        assert decoded.tobytes() == diff_image.tobytes()
+        assert decoded.convert("RGBA").tobytes() == diff_image.convert("RGBA").tobytes()
+    # Bit depth byte of the IHDR chunk
+    assert encoded[24] == 1
@@ -0,0 +1,117 @@
+import os
+import shutil
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+from assertis import digest_cache, md5_utils
+from assertis.cmd_verify import verify_report
+from assertis.comparison import run_comparison, write_comparison
+from assertis.digest_cache import DigestCache
+from assertis.md5_utils import Digests
+from assertis.models import iter_report_files
+
+
+def count_md5_hash(monkeypatch):
+    "Count the calls to md5_hash per path."
+    calls = Counter()
+    md5_hash = md5_utils.md5_hash
+
+    def counting_md5_hash(path):
+        calls[Path(path)] += 1
+        return md5_hash(path)
+
+    monkeypatch.setattr(md5_utils, "md5_hash", counting_md5_hash)
+    return calls
+
+
+def test_each_file_hashed_once(monkeypatch):
+    calls = count_md5_hash(monkeypatch)
+    cases = Path("testcases/lots_of_files")
+    run_comparison(cases / "expected", cases / "actual", 0, cache=False)
+
+    assert len(calls) == 20
+    assert set(calls.values()) == {1}
+
+
+def test_cache_skips_unchanged_files(tmp_path, monkeypatch):
+    cases = Path("testcases/lots_of_files")
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    shutil.copytree(cases / "expected", expected)
+    shutil.copytree(cases / "actual", actual)
+    an_hour_ago = time.time() - 3600
+    for path in [*expected.iterdir(), *actual.iterdir()]:
+        os.utime(path, (an_hour_ago, an_hour_ago))
+
+    first = run_comparison(expected, actual, 0)
+    calls = count_md5_hash(monkeypatch)
+    second = run_comparison(expected, actual, 0)
+    assert not calls
+    assert second.model_dump() == first.model_dump()
+
+    shutil.copy(actual / "img_2.jpg", actual / "img_1.jpg")
+    os.utime(actual / "img_1.jpg", (an_hour_ago, an_hour_ago + 1))
+    third = run_comparison(expected, actual, 0)
+    assert calls == {actual / "img_1.jpg": 1}
+    assert third.model_dump() != first.model_dump()
+
+
+def test_md5_hash_bounded_memory(tmp_path):
+    path = tmp_path / "large.bmp"
+    with open(path, "wb") as f:
+        f.truncate(256 * 1024 * 1024)
+
+    tracemalloc.start()
+    digest = md5_utils.md5_hash(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert digest == "1f5039e50bd66b290c56684d8550c6c2"
+    assert peak < 4 * md5_utils.CHUNK_SIZE
+
+
+def cached_paths(cache):
+    return {path for (path,) in cache.connect().execute("SELECT path FROM digests")}
+
+
+def test_cache_sweep_prunes_deleted_and_unused_files(tmp_path):
+    an_hour_ago = time.time() - 3600
+    paths = [tmp_path / name for name in ["kept.png", "deleted.png", "unused.png"]]
+    cache = DigestCache(tmp_path / "digests.sqlite3")
+    for path in paths:
+        path.write_bytes(b"image")
+        os.utime(path, (an_hour_ago, an_hour_ago))
+        cache.put(path, path.stat(), "md5")
+    assert cached_paths(cache) == {str(path.resolve()) for path in paths}
+
+    paths[1].unlink()
+    with cache.connect() as connection:
+        connection.execute(
+            "UPDATE digests SET used_at = 0 WHERE path = ?", (str(paths[2]),)
+        )
+    day_ago = time.time() - digest_cache.SWEEP_INTERVAL - 1
+    os.utime(tmp_path / "digests.sqlite3.swept", (day_ago, day_ago))
+
+    assert cached_paths(DigestCache(tmp_path / "digests.sqlite3")) == {
+        str(paths[0].resolve())
+    }
+
+
+def test_verify_keeps_report_files_out_of_cache(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    expected, report_dir = tmp_path / "expected", tmp_path / "report"
+    shutil.copytree(cases / "expected", expected)
+    write_comparison(expected, cases / "actual", report_dir, 0)
+    an_hour_ago = time.time() - 3600
+    for path in [*expected.iterdir(), *report_dir.iterdir()]:
+        os.utime(path, (an_hour_ago, an_hour_ago))
+
+    cache = DigestCache()
+    errors = verify_report(
+        iter_report_files(report_dir), report_dir, expected, Digests(cache)
+    )
+    assert not errors
+    paths = cached_paths(cache)
+    assert paths
+    assert not [path for path in paths if path.startswith(str(report_dir.resolve()))]
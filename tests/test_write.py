@@ -0,0 +1,99 @@
+import json
+import shutil
+from pathlib import Path
+
+from PIL import Image
+
+from assertis import write
+from assertis.cmd_verify import verify_report
+from assertis.comparison import run_comparison
+
+
+def test_rewrite_skips_existing_and_removes_orphans(tmp_path, monkeypatch):
+    cases = Path("testcases/lots_of_files")
+    report_dir = tmp_path / "report"
+    report_dir.mkdir()
+
+    report = run_comparison(cases / "expected", cases / "actual", 0)
+    write.write_report(report, report_dir)
+    written = {path.name for path in report_dir.iterdir()}
+    assert written == write.referenced_files(report) | {
+        "index.html",
+        "report.json",
+        "thumbnails",
+    }
+    assert verify_report(report.files, report_dir, cases / "expected") == []
+
+    orphan = report_dir / ("0" * 32 + ".jpg")
+    orphan.write_bytes(b"orphan")
+    unrelated = report_dir / "notes.txt"
+    unrelated.write_text("keep me")
+
+    copies = []
+    monkeypatch.setattr(write, "copy_file", lambda *args: copies.append(args))
+    report = run_comparison(cases / "expected", cases / "actual", 0)
+    write.write_report(report, report_dir)
+
+    assert copies == []
+    assert not orphan.exists()
+    assert unrelated.exists()
+
+
+def test_shared_assets_written_once(tmp_path):
+    placeholder = Path("testcases/files_unchanged/expected/img1.jpg")
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    for directory in [expected, actual]:
+        directory.mkdir()
+        for name in ["a.jpg", "b.jpg", "c.jpg"]:
+            shutil.copy(placeholder, directory / name)
+    report_dir = tmp_path / "report"
+    report_dir.mkdir()
+
+    report = run_comparison(expected, actual, 0)
+    assert len(report.outputs) == 1
+    write.write_report(report, report_dir)
+
+    size = placeholder.stat().st_size
+    assert report.output_stats == {
+        "written": 1,
+        "written_bytes": size,
+        "skipped": 2,
+        "skipped_bytes": 2 * size,
+    }
+
+
+def test_paged_html_report(tmp_path):
+    cases = Path("testcases/lots_of_files")
+    report = run_comparison(cases / "expected", cases / "actual", 0)
+    write.write_report(report, tmp_path, page_size=3)
+
+    pages = sorted(path.name for path in (tmp_path / "pages").iterdir())
+    assert pages == ["changed-0.json", "changed-1.json"] + [
+        "unchanged-0.json",
+        "unchanged-1.json",
+    ]
+    with open(tmp_path / "pages" / "changed-1.json") as f:
+        assert [file["name"] for file in json.load(f)] == ["img_6.jpg", "img_8.jpg"]
+    assert "data-modal-data-list" not in (tmp_path / "index.html").read_text()
+
+    write.write_report(report, tmp_path)
+    assert not (tmp_path / "pages").exists()
+
+
+def test_thumbnails_written_and_cached(tmp_path, monkeypatch):
+    cases = Path("testcases/lots_of_files")
+    monkeypatch.setattr(write, "THUMBNAIL_SIZE", (100, 100))
+    report = run_comparison(cases / "expected", cases / "actual", 0)
+    write.write_report(report, tmp_path)
+
+    for filename in write.referenced_files(report):
+        with Image.open(tmp_path / write.thumbnail_name(filename)) as thumbnail:
+            assert thumbnail.size == (67, 100)
+    stale = tmp_path / write.thumbnail_name("0" * 32 + ".jpg")
+    stale.write_bytes(b"stale")
+
+    opened = []
+    monkeypatch.setattr(write.Image, "open", lambda *args: opened.append(args))
+    write.write_report(report, tmp_path)
+    assert opened == []
+    assert not stale.exists()